@@ -8,25 +8,30 @@ from pathlib import Path
 HOST = '127.0.0.1'
 PORT = 5030
 
-import re, os
+import re, os, shutil, uuid
 
 import socket
 
-import google.generativeai as genai
-
 from google.api_core.exceptions import ServerError, TooManyRequests, RetryError
 
 import traceback
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import threading, webbrowser, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from waitress import serve
-from google.generativeai.types import RequestOptions
-from google.api_core import retry
 
 import json
-from cfg import ROOT_DIR, TMP_DIR, logger, safetySettings
+from cfg import ROOT_DIR, TMP_DIR, get_logger, brief, TRANS_CONCURRENCY, TRANS_RPM, \
+    TRANS_TPM, RECOGN_WINDOW, RECOGN_OVERLAP, SERVER_THREADS, SSE_MAX_STREAMS, SSE_MAX_SECONDS
 import tools
+import cache
+import backends
+import jobs
+import metrics
+import uploads
+
+logger = get_logger('app')
 
 app = Flask(__name__, template_folder=f'{ROOT_DIR}/templates', static_folder=os.path.join(ROOT_DIR, 'tmp'),
             static_url_path='/tmp')
@@ -47,10 +52,12 @@ with open(ROOT_DIR + "/prompt.json", 'r', encoding='utf-8') as f:
 class Gemini():
 
     def __init__(self, *, language=None, text="", api_key="", model_name='gemini-1.5-flash', piliang=50, waitsec=10,
-                 audio_file=None):
+                 audio_file=None, proxy=None, concurrency=TRANS_CONCURRENCY, rpm=TRANS_RPM, tpm=TRANS_TPM,
+                 window=RECOGN_WINDOW, overlap=RECOGN_OVERLAP):
         logger.debug(f"Initializing Gemini with language={language}, text length={len(text)}, "
                      f"api_key={'set' if api_key else 'not set'}, model_name={model_name}, "
-                     f"piliang={piliang}, waitsec={waitsec}, audio_file={audio_file}")
+                     f"piliang={piliang}, waitsec={waitsec}, audio_file={audio_file}, "
+                     f"proxy={'set' if proxy else 'not set'}, concurrency={concurrency}, rpm={rpm}, tpm={tpm}, window={window}, overlap={overlap}")
         self.language = language
 
         self.srt_text = text
@@ -59,195 +66,225 @@ class Gemini():
         self.piliang = piliang
         self.waitsec = waitsec
         self.audio_file = audio_file
+        self.concurrency = concurrency
+        # 未指定 rpm 时，沿用 waitsec 作为相邻两次请求的最小间隔
+        self.rpm = rpm if rpm > 0 else (60 / waitsec if waitsec > 0 else 0)
+        self.tpm = tpm
+        self.window = window
+        self.overlap = overlap
+        # 模型后端由 LLM_BACKEND 决定，gemini 后端同一 api_key、模型和代理的请求复用客户端及其连接
+        self.backend = backends.get(api_key, model_name, proxy)
 
     # 三步反思翻译srt字幕
     def run_trans(self):
         logger.debug("Starting run_trans method.")
         text_list = tools.get_subtitle_from_srt(self.srt_text, is_file=False)
         logger.debug(f"Retrieved {len(text_list)} subtitle entries.")
-        split_source_text = [text_list[i:i + self.piliang] for i in range(0, len(text_list), self.piliang)]
+        split_source_text = [text_list.slice(i, i + self.piliang) for i in range(0, len(text_list), self.piliang)]
         logger.debug(f"Split subtitles into {len(split_source_text)} batches of up to {self.piliang} entries each.")
 
-        genai.configure(api_key=self.api_key)
-        logger.debug("Configured genai with provided API key.")
-        model = genai.GenerativeModel(self.model_name, safety_settings=safetySettings)
-        logger.debug(f"Initialized GenerativeModel with model_name={self.model_name}.")
-
-        result_str = ""
         req_nums = len(split_source_text)
-        print(f'\n本次翻译将分 {req_nums} 次发送请求,每次发送 {self.piliang} 条字幕,可在 logs 目录下查看日志')
-        logger.info(f"Starting translation with {req_nums} requests.")
-        for i, it in enumerate(split_source_text):
-            srt_str = "\n\n".join(
-                [f"{srtinfo['line']}\n{srtinfo['time']}\n{srtinfo['text'].strip()}" for srtinfo in it])
-            logger.debug(f"Processing batch {i+1}/{req_nums} with {len(it)} subtitles.")
-            response = None
-
-            try:
-                prompt = PROMPT_LIST['prompt_trans'].replace('{lang}', self.language).replace('<INPUT></INPUT>',
-                                                                                              f'<INPUT>{srt_str}</INPUT>')
-                logger.debug(f"Constructed prompt for batch {i+1}.")
-
-                print(f'开始发送请求 {i=}')
-                logger.info(f"Sending request {i+1}/{req_nums} to Gemini API.")
-                response = model.generate_content(
-                    prompt,
-                    safety_settings=safetySettings
-                )
-                logger.info(f'\n[Gemini]返回: response.text={response.text}')
-                result_it = self._extract_text_from_tag(response.text)
-                if not result_it:
-                    start_line = i * self.piliang + 1
-                    msg = (f"{start_line}->{(start_line + len(it))}行翻译结果出错{response.text}")
-                    logger.error(msg)
-                    result_str += msg.strip() + "\n\n"
-                    continue
-                result_str += result_it.strip() + "\n\n"
-                logger.debug(f"Batch {i+1} translated successfully.")
-            except (ServerError, RetryError, socket.timeout) as e:
-                logger.error("无法连接到Gemini,请尝试使用或更换代理", exc_info=True)
-                raise Exception('无法连接到Gemini,请尝试使用或更换代理') from e
-            except TooManyRequests as e:
-                logger.error("429请求太频繁", exc_info=True)
-                raise Exception('429请求太频繁') from e
-            except Exception as e:
-                error = str(e)
-                logger.error(f"Exception occurred: {error}", exc_info=True)
-                if response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
-                    raise Exception(self._get_error(response.prompt_feedback.block_reason, "forbid")) from e
-
-                if 'User location is not supported' in error or 'time out' in error:
-                    raise Exception("当前请求ip(或代理服务器)所在国家不在Gemini API允许范围") from e
-
-                if response and hasattr(response, 'candidates') and len(response.candidates) > 0:
-                    candidate = response.candidates[0]
-                    if candidate.finish_reason not in [0, 1]:
-                        raise Exception(self._get_error(candidate.finish_reason)) from e
-                    if candidate.finish_reason == 1 and candidate.content and hasattr(candidate.content, 'parts'):
-                        result_it = self._extract_text_from_tag(response.text)
-                        if not result_it:
-                            raise Exception(f"翻译结果出错{response.text}") from e
-                        result_str += result_it.strip() + "\n\n"
-                        continue
-                raise
-            finally:
-                if i < req_nums - 1:
-                    print(f'请求 {i=} 结束，防止 429 错误， 暂停 {self.waitsec}s 后继续下次请求')
-                    logger.debug(f"Sleeping for {self.waitsec} seconds to prevent 429 errors.")
-                    time.sleep(self.waitsec)
+        concurrency = max(1, min(self.concurrency, req_nums))
+        # 以令牌桶代替每次请求后固定暂停，多个批次并发发送，按 rpm/tpm 限流防止 429
+        limiter = tools.RateLimiter(rpm=self.rpm, tpm=self.tpm)
+        print(f'\n本次翻译将分 {req_nums} 次发送请求,每次发送 {self.piliang} 条字幕,并发 {concurrency} 个请求,可在 logs 目录下查看日志')
+        logger.info(f"Starting translation with {req_nums} requests, concurrency={concurrency}, "
+                    f"rpm={self.rpm}, tpm={self.tpm}.")
+        # 按批次序号存放结果，保证并发完成后仍按行顺序拼接
+        results = [""] * req_nums
+        pool = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            futures = {
+                pool.submit(jobs.bind(self._trans_batch), limiter, i, it, req_nums): i
+                for i, it in enumerate(split_source_text)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                jobs.report('generate', batch=futures[future], done=done, total=req_nums)
+        finally:
+            # 任一批次出错时取消尚未开始的批次
+            pool.shutdown(wait=True, cancel_futures=True)
         print(f'翻译结束\n\n')
         logger.info("Translation process completed.")
-        return result_str
+        return "".join(results)
+
+    # 翻译单个批次，返回以空行结尾的字幕文本
+    def _trans_batch(self, limiter, i, it, req_nums):
+        srt_str = it.to_srt()
+        logger.debug(f"Processing batch {i+1}/{req_nums} with {len(it)} subtitles.")
+        response = None
 
-    # 转录音视频为字幕
+        try:
+            prompt = PROMPT_LIST['prompt_trans'].replace('{lang}', self.language).replace('<INPUT></INPUT>',
+                                                                                          f'<INPUT>{srt_str}</INPUT>')
+            logger.debug(f"Constructed prompt for batch {i+1}.")
+            # 三步反思法会输出约 3 倍于原字幕的内容，一并计入 token 预算
+            limiter.acquire(tools.estimate_tokens(prompt) + 3 * tools.estimate_tokens(srt_str))
+
+            print(f'开始发送请求 {i=}')
+            logger.info(f"Sending request {i+1}/{req_nums} to Gemini API.")
+            with jobs.stage('generate', batch=i):
+                response = self.backend.generate(prompt)
+            logger.info('\n[Gemini]返回: response.text=%s', brief(response.text))
+            result_it = self._extract_text_from_tag(response.text)
+            if not result_it:
+                start_line = i * self.piliang + 1
+                msg = (f"{start_line}->{(start_line + len(it))}行翻译结果出错{response.text}")
+                logger.error(msg)
+                return msg.strip() + "\n\n"
+            logger.debug(f"Batch {i+1} translated successfully.")
+            return result_it.strip() + "\n\n"
+        except (ServerError, RetryError, socket.timeout) as e:
+            logger.error("无法连接到Gemini,请尝试使用或更换代理", exc_info=True)
+            raise Exception('无法连接到Gemini,请尝试使用或更换代理') from e
+        except TooManyRequests as e:
+            logger.error("429请求太频繁", exc_info=True)
+            raise Exception('429请求太频繁') from e
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Exception occurred: {error}", exc_info=True)
+            if response and hasattr(response, 'prompt_feedback') and response.prompt_feedback.block_reason:
+                raise Exception(self._get_error(response.prompt_feedback.block_reason, "forbid")) from e
+
+            if 'User location is not supported' in error or 'time out' in error:
+                raise Exception("当前请求ip(或代理服务器)所在国家不在Gemini API允许范围") from e
+
+            if response and hasattr(response, 'candidates') and len(response.candidates) > 0:
+                candidate = response.candidates[0]
+                if candidate.finish_reason not in [0, 1]:
+                    raise Exception(self._get_error(candidate.finish_reason)) from e
+                if candidate.finish_reason == 1 and candidate.content and hasattr(candidate.content, 'parts'):
+                    result_it = self._extract_text_from_tag(response.text)
+                    if not result_it:
+                        raise Exception(f"翻译结果出错{response.text}") from e
+                    return result_it.strip() + "\n\n"
+            raise
+
+    # 转录音视频为字幕，时长超过 window 秒时按静音处分段并发转录后拼接
     def run_recogn(self):
         logger.debug("Starting run_recogn method.")
-        tmpname = f'{TMP_DIR}/{time.time()}.mp3'
-        logger.debug(f"Temporary audio file created: {tmpname}")
-        tools.runffmpeg(['ffmpeg', '-y', '-i', self.audio_file, '-ac', '1', '-ar', '8000', tmpname])
-        self.audio_file = tmpname
+        self.audio_file = cache.transcode(self.audio_file, cache.AUDIO_TRANSCODE_ARGS, 'mp3')
+        logger.debug(f"Transcoded audio file: {self.audio_file}")
         prompt = PROMPT_LIST['prompt_recogn']
         if self.language:
             prompt += PROMPT_LIST['prompt_recogn_trans'].replace('{lang}', self.language)
             logger.debug(f"Added translation prompt for language: {self.language}")
 
+        duration = tools.get_video_ms(self.audio_file) / 1000
+        if self.window > 0 and duration > self.window + self.overlap:
+            return self._recogn_windows(prompt, duration)
+
+        recogn, trans = self._recogn_file(prompt, self.audio_file)
+        result = [it for it in (recogn, trans) if it]
+        if not result:
+            logger.error('结果为空')
+            raise Exception('结果为空')
+        logger.debug("Recognition and translation completed successfully.")
+        return result
+
+    # 分段转录：按静音处切分为约 window 秒的分段，前后各扩展 overlap 秒后并发提交，再按全局时间拼接
+    def _recogn_windows(self, prompt, duration):
+        with jobs.stage('silence'):
+            silences = tools.detect_silences(self.audio_file)
+        windows = tools.plan_windows(duration, silences, self.window)
+        req_nums = len(windows)
+        concurrency = max(1, min(self.concurrency, req_nums))
+        limiter = tools.RateLimiter(rpm=self.rpm, tpm=self.tpm)
+        print(f'\n音视频时长 {int(duration)} 秒,将分 {req_nums} 段转录,并发 {concurrency} 个请求')
+        logger.info(f"Starting segmented recognition of {duration}s audio with {req_nums} windows, "
+                    f"concurrency={concurrency}, overlap={self.overlap}, rpm={self.rpm}, tpm={self.tpm}.")
+
+        work_dir = f'{TMP_DIR}/recogn-{uuid.uuid4().hex}'
+        Path(work_dir).mkdir(parents=True, exist_ok=True)
+        # 每段为 (分段文件开始秒, 分段文件结束秒)，含前后重叠部分
+        spans = [(max(0.0, s - self.overlap), min(duration, e + self.overlap)) for s, e in windows]
+        results = [None] * req_nums
+        pool = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            futures = {
+                pool.submit(jobs.bind(self._recogn_window), limiter, prompt, i, spans[i], f'{work_dir}/{i}.mp3'): i
+                for i in range(req_nums)
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                jobs.report('generate', window=futures[future], done=done, total=req_nums)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            shutil.rmtree(work_dir, ignore_errors=True)
+
         result = []
+        for n in range(2):
+            parts = [(results[i][n], spans[i][0], s, e) for i, (s, e) in enumerate(windows)]
+            if any(it[0] for it in parts):
+                result.append(tools.stitch_srt(parts))
+        if not result:
+            logger.error('结果为空')
+            raise Exception('结果为空')
+        logger.info("Segmented recognition completed successfully.")
+        return result
+
+    # 转录单个分段，返回 (转录字幕, 翻译字幕)，时间相对于分段开始
+    def _recogn_window(self, limiter, prompt, i, span, out):
+        start, end = span
+        tools.cut_audio(source=self.audio_file, start=start, end=end, out=out)
+        # Gemini 音频按每秒 32 token 计费
+        limiter.acquire(tools.estimate_tokens(prompt) + int(32 * (end - start)))
+        logger.info(f"Sending recognition window {i}: {start:.3f}-{end:.3f}s")
+        recogn, trans = self._recogn_file(prompt, out)
+        if not recogn and not trans:
+            logger.warning(f"Recognition window {i} ({start:.3f}-{end:.3f}s) returned nothing")
+        return recogn, trans
+
+    # 提交一个音频文件进行转录，返回 (转录字幕, 翻译字幕)，未找到的部分为 None
+    def _recogn_file(self, prompt, audio_file):
         while True:
             try:
-                genai.configure(api_key=self.api_key)
-                logger.debug("Configured genai with provided API key for recognition.")
-                model = genai.GenerativeModel(
-                    self.model_name,
-                    safety_settings=safetySettings
-                )
-                logger.debug(f"Initialized GenerativeModel with model_name={self.model_name} for recognition.")
-
-                sample_audio = genai.upload_file(self.audio_file)
-                logger.debug(f"Uploaded audio file: {self.audio_file}, response: {sample_audio}")
-
-                response = model.generate_content([prompt, sample_audio], request_options={"timeout": 600})
+                sample_audio = self.backend.prepare(audio_file)
+                logger.debug("Uploaded audio file: %s, response: %s", audio_file, sample_audio)
+
+                with jobs.stage('generate'):
+                    response = self.backend.generate([prompt, sample_audio], timeout=600)
                 res_str = response.text.strip()
-                logger.info(f"Recognition response: {res_str}")
+                logger.info("Recognition response: %s", brief(res_str))
+                recogn, trans = None, None
                 recogn_res = re.search(r'<RECONGITION>(.*)</RECONGITION>', res_str, re.I | re.S)
                 if recogn_res:
-                    result.append(recogn_res.group(1))
+                    recogn = recogn_res.group(1)
                     logger.debug("Extracted recognition result from response.")
                 trans_res = re.search(r'<TRANSLATE>(.*)</TRANSLATE>', res_str, re.I | re.S)
                 if trans_res:
-                    result.append(trans_res.group(1))
+                    trans = trans_res.group(1)
                     logger.debug("Extracted translation result from response.")
-                if not result:
-                    logger.error('结果为空')
-                    raise Exception('结果为空')
-                logger.debug("Recognition and translation completed successfully.")
-                return result
+                return recogn, trans
             except (ServerError, RetryError, socket.timeout) as e:
                 logger.error("无法连接到Gemini,请尝试使用或更换代理", exc_info=True)
                 raise Exception('无法连接到Gemini,请尝试使用或更换代理') from e
             except TooManyRequests as e:
                 logger.warning("429请求太频繁，暂停60s后重试", exc_info=True)
                 time.sleep(60)
+                metrics.RETRIES.inc(kind='gemini')
                 continue
             except Exception as e:
                 logger.error("Exception occurred during recognition:", exc_info=True)
                 raise
-            finally:
-                try:
-                    Path(self.audio_file).unlink(missing_ok=True)
-                    logger.debug(f"Removed temporary audio file: {self.audio_file}")
-                except Exception as e:
-                    logger.warning(f"Failed to remove temporary audio file: {self.audio_file}", exc_info=True)
 
     # 总结视频
     def run_zongjie(self):
         logger.debug("Starting run_zongjie method.")
-        tmpname = f'{TMP_DIR}/{time.time()}.mp4'
-        logger.debug(f"Temporary video file created for summarization: {tmpname}")
-        tools.runffmpeg(
-            ['ffmpeg', '-y', '-i', self.audio_file, '-c:v', 'libx265', '-ac', '1', '-ar', '16000', '-preset',
-             'superfast', tmpname])
-        self.audio_file = tmpname
+        self.audio_file = cache.transcode(self.audio_file, cache.VIDEO_TRANSCODE_ARGS, 'mp4')
+        logger.debug(f"Transcoded video file for summarization: {self.audio_file}")
         prompt = PROMPT_LIST['prompt_zongjie']
         logger.debug("Constructed summarization prompt.")
         result = ""
         while True:
             try:
-                genai.configure(api_key=self.api_key)
-                logger.debug("Configured genai with provided API key for summarization.")
-                model = genai.GenerativeModel(
-                    self.model_name,
-                    safety_settings=safetySettings
-                )
-                logger.debug(f"Initialized GenerativeModel with model_name={self.model_name} for summarization.")
-
-                sample_audio = genai.upload_file(self.audio_file)
-                logger.debug(f"Uploaded audio file for summarization: {self.audio_file}, response: {sample_audio}")
-                while sample_audio.state.name == "PROCESSING":
-                    logger.debug("Audio file is still processing. Waiting...")
-                    print('.', end='')
-                    time.sleep(10)
-                    sample_audio = genai.get_file(sample_audio.name)
-                logger.debug("Audio file processing completed.")
-
-                chat_session = model.start_chat(
-                    history=[
-                        {
-                            "role": "user",
-                            "parts": [
-                                sample_audio,
-                            ],
-                        }
-                    ])
-                logger.debug("Started chat session for summarization.")
-                response = chat_session.send_message(
-                    prompt,
-                    request_options=RequestOptions(
-                        retry=retry.Retry(initial=10, multiplier=2, maximum=60, timeout=900),
-                        timeout=900
-                    )
-                )
+                sample_audio = self.backend.prepare(self.audio_file)
+                logger.debug("Uploaded audio file for summarization: %s, response: %s", self.audio_file, sample_audio)
+
+                with jobs.stage('generate'):
+                    response = self.backend.chat([sample_audio], prompt, timeout=900)
                 result = response.text.strip()
-                logger.info(f"Summarization response: {result}")
+                logger.info("Summarization response: %s", brief(result))
                 return result
             except (ServerError, RetryError, socket.timeout) as e:
                 logger.error("无法连接到Gemini,请尝试使用或更换代理", exc_info=True)
@@ -258,72 +295,33 @@ class Gemini():
             except Exception as e:
                 logger.error("Exception occurred during summarization:", exc_info=True)
                 raise
-            finally:
-                try:
-                    Path(self.audio_file).unlink(missing_ok=True)
-                    logger.debug(f"Removed temporary video file: {self.audio_file}")
-                except Exception as e:
-                    logger.warning(f"Failed to remove temporary video file: {self.audio_file}", exc_info=True)
 
     def run_jieshuo(self):
         logger.debug("Starting run_jieshuo method.")
-        tmpname = f'{TMP_DIR}/{time.time()}.mp4'
-        logger.debug(f"Temporary video file created for narration: {tmpname}")
-        tools.runffmpeg(
-            ['ffmpeg', '-y', '-i', self.audio_file, '-c:v', 'libx265', '-ac', '1', '-ar', '16000', '-preset',
-             'superfast','-threads','16', tmpname])
-        self.audio_file = tmpname
+        self.audio_file = cache.transcode(self.audio_file, cache.VIDEO_TRANSCODE_ARGS, 'mp4')
+        logger.debug(f"Transcoded video file for narration: {self.audio_file}")
         prompt = PROMPT_LIST['prompt_jieshuo']
         logger.debug("Constructed narration prompt.")
         result = {"timelist": [], "srt": ""}
         while True:
             try:
-                genai.configure(api_key=self.api_key)
-                logger.debug("Configured genai with provided API key for narration.")
-                model = genai.GenerativeModel(
-                    self.model_name,
-                    safety_settings=safetySettings
-                )
-                logger.debug(f"Initialized GenerativeModel with model_name={self.model_name} for narration.")
-
-                sample_audio = genai.upload_file(self.audio_file)
-                logger.debug(f"Uploaded audio file for narration: {self.audio_file}, response: {sample_audio}")
-                while sample_audio.state.name == "PROCESSING":
-                    logger.debug("Audio file is still processing. Waiting...")
-                    print('.', end='')
-                    time.sleep(10)
-                    sample_audio = genai.get_file(sample_audio.name)
-                logger.debug("Audio file processing completed.")
-
-                chat_session = model.start_chat(
-                    history=[
-                        {
-                            "role": "user",
-                            "parts": [
-                                sample_audio,
-                            ],
-                        }
-                    ])
-                logger.debug("Started chat session for narration.")
-                response = chat_session.send_message(
-                    prompt,
-                    request_options=RequestOptions(
-                        retry=retry.Retry(initial=10, multiplier=2, maximum=60, timeout=900),
-                        timeout=900
-                    )
-                )
+                sample_audio = self.backend.prepare(self.audio_file)
+                logger.debug("Uploaded audio file for narration: %s, response: %s", self.audio_file, sample_audio)
+
+                with jobs.stage('generate'):
+                    response = self.backend.chat([sample_audio], prompt, timeout=900)
 
                 res_str = response.text.strip()
-                logger.info(f"Narration response: {res_str}")
+                logger.info("Narration response: %s", brief(res_str))
                 time_1 = re.search(r'<TIME>\**?(.*)\**?</TIME>', res_str, re.I | re.S)
                 if time_1:
                     result['timelist'] = time_1.group(1).strip()
-                    logger.debug(f"Extracted timelist: {result['timelist']}")
+                    logger.debug("Extracted timelist: %s", brief(result['timelist']))
 
                 srt_2 = re.search(r'<SRT>\**?(.*)\**?</SRT>', res_str, re.I | re.S)
                 if srt_2:
                     result["srt"] = srt_2.group(1).strip()
-                    logger.debug(f"Extracted SRT: {result['srt']}")
+                    logger.debug("Extracted SRT: %s", brief(result['srt']))
                 if not result:
                     logger.error('结果为空')
                     raise Exception('结果为空')
@@ -338,19 +336,13 @@ class Gemini():
             except Exception as e:
                 logger.error("Exception occurred during narration:", exc_info=True)
                 raise
-            finally:
-                try:
-                    Path(self.audio_file).unlink(missing_ok=True)
-                    logger.debug(f"Removed temporary video file: {self.audio_file}")
-                except Exception as e:
-                    logger.warning(f"Failed to remove temporary video file: {self.audio_file}", exc_info=True)
 
     def _extract_text_from_tag(self, text):
         logger.debug("Extracting text from response tags.")
         match = re.search(r'<step3_refined_translation>(.*?)</step3_refined_translation>', text, re.S)
         if match:
             extracted_text = match.group(1)
-            logger.debug(f"Extracted text: {extracted_text}")
+            logger.debug("Extracted text: %s", brief(extracted_text))
             return extracted_text
         else:
             logger.debug("No matching tag found for text extraction.")
@@ -400,6 +392,74 @@ def update_prompt():
     return jsonify({"code": 0, "msg": "ok"})
 
 
+# 音频文件保存位置，使用时间戳生成文件名
+def _audio_target(filename):
+    file_ext = os.path.splitext(filename)[1]
+    return f'{TMP_DIR}/{time.time()}{file_ext}'
+
+
+# 视频按原文件名创建工作目录，返回原始视频保存位置
+def _video_target(filename):
+    name, file_ext = os.path.splitext(filename)
+    name = re.sub(r'["\'?,\[\]{}()`!@#$%\^&*+=\\;:><，。、？：；“”‘’—｛（）｝·|~ \s]', '_', name.strip())
+    dirname = name + "-" + tools.get_md5(filename)
+    logger.debug(f"Generated filename for video: {dirname}")
+    # 创建目录
+    target_dir = TMP_DIR + f'/{dirname}'
+    Path(target_dir).mkdir(parents=True, exist_ok=True)
+    return f'{target_dir}/raw{file_ext}'
+
+
+# 后台转换中的视频 {raw.mp4 路径: Job}，转换结束后移除
+_pending_videos = {}
+_pending_lock = threading.Lock()
+
+
+# 转换任务的执行体，结束时(无论成败)从 _pending_videos 中移除
+def _remux_video(raw_file, mp4_file):
+    try:
+        return tools.remux_to_mp4(raw_file, mp4_file)
+    finally:
+        with _pending_lock:
+            _pending_videos.pop(mp4_file, None)
+
+
+# 非 mp4 视频在后台转为 mp4，返回后续处理使用的视频路径以及转换任务(无需转换时为 None)
+def _prepare_video(raw_file):
+    target_dir = Path(raw_file).parent.as_posix()
+    file_ext = os.path.splitext(raw_file)[1]
+    mp4_file = f'{target_dir}/raw.mp4'
+    if file_ext.lower() == '.mp4':
+        return mp4_file, None
+    # 持锁提交并登记，任务很快结束时其移除操作也在登记之后
+    with _pending_lock:
+        job = jobs.submit('remux', _remux_video, raw_file, mp4_file)
+        _pending_videos[mp4_file] = job
+    logger.info(f"Converting video to MP4 format in job {job.id}: {mp4_file}")
+    return mp4_file, job
+
+
+# 等待上传的视频转换完成，转换失败时抛出异常
+def _wait_video(video_file):
+    with _pending_lock:
+        job = _pending_videos.get(video_file)
+    if job is not None:
+        if not job.finished:
+            jobs.report('remux', message='等待视频转换')
+            job.wait()
+        if job.status == 'failed':
+            raise Exception(f'视频转换失败: {job.error}')
+    # 转换在本次请求之前已结束时不再有记录，失败的转换不会生成 raw.mp4
+    if not Path(video_file).is_file():
+        raise Exception('视频不存在或转换失败，请重新上传')
+
+
+# 上传视频的返回值，data 立即可用作 video_file，job_id 为后台转换任务，可通过 /job/<id> 查询是否就绪
+def _upload_video_result(raw_file):
+    mp4_file, job = _prepare_video(raw_file)
+    return jsonify({'code': 0, 'msg': 'ok', 'data': mp4_file, 'job_id': job.id if job else None})
+
+
 @app.route('/upload', methods=['POST'])
 def upload():
     logger.debug("Received request to upload audio file.")
@@ -413,11 +473,7 @@ def upload():
             logger.warning("No selected file in the request.")
             return jsonify({"code": 1, 'msg': 'No selected file'})
 
-        # 获取文件扩展名
-        file_ext = os.path.splitext(file.filename)[1]
-        name = re.sub(r'["\'?,\[\]{}()`!@#$%\^&*+=\\;:><，。、？：；“”‘’—｛（）｝·|~]', '_', file.filename)
-        # 使用时间戳生成文件名
-        filename = f'{TMP_DIR}/{time.time()}{file_ext}'
+        filename = _audio_target(file.filename)
         file.save(filename)
         logger.info(f"Uploaded audio file saved as {filename}.")
         return jsonify({'code': 0, 'msg': 'ok', 'data': filename})
@@ -439,27 +495,77 @@ def upload_video():
             logger.warning("No selected file in the video upload request.")
             return jsonify({"code": 1, 'msg': 'No selected file'})
 
-        # 获取文件扩展名
-        name, file_ext = os.path.splitext(file.filename)
-        name = re.sub(r'["\'?,\[\]{}()`!@#$%\^&*+=\\;:><，。、？：；“”‘’—｛（）｝·|~ \s]', '_', name.strip())
-        # 使用时间戳生成文件名
-        filename = name + "-" + tools.get_md5(file.filename)
-        logger.debug(f"Generated filename for video: {filename}")
-        # 创建目录
-        target_dir = TMP_DIR + f'/{filename}'
-        Path(target_dir).mkdir(parents=True, exist_ok=True)
-        file.save(f'{target_dir}/raw{file_ext}')
-        logger.info(f"Saved raw video file to {target_dir}/raw{file_ext}.")
-        # 保存文件到 /tmp 目录
-        if file_ext.lower() != '.mp4':
-            tools.runffmpeg(['-y', '-i', f'{target_dir}/raw{file_ext}', '-c:v', 'copy', f'{target_dir}/raw.mp4'])
-            logger.info(f"Converted video to MP4 format: {target_dir}/raw.mp4")
-        return jsonify({'code': 0, 'msg': 'ok', 'data': f'{target_dir}/raw.mp4'})
+        raw_file = _video_target(file.filename)
+        file.save(raw_file)
+        logger.info(f"Saved raw video file to {raw_file}.")
+        return _upload_video_result(raw_file)
     except Exception as e:
         logger.error("Error during video upload:", exc_info=True)
         return jsonify({"code": 1, 'msg': str(e)})
 
 
+# 分片上传：初始化，kind 为 audio 或 video，upload_id 为要恢复的未完成上传，返回上传 id、已接收偏移量和分片大小
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    data = request.get_json(silent=True) or {}
+    logger.debug("Received chunked upload init: %s", data)
+    if data.get('kind') not in ('audio', 'video') or not data.get('filename'):
+        return jsonify({"code": 1, 'msg': 'No selected file'})
+    try:
+        meta = uploads.init(filename=data['filename'], size=_intparam(data.get('size')), kind=data['kind'],
+                            sha256=data.get('sha256'), upload_id=data.get('upload_id'))
+        return jsonify({'code': 0, 'msg': 'ok', 'data': meta})
+    except Exception as e:
+        logger.error("Error during chunked upload init:", exc_info=True)
+        return jsonify({"code": 1, 'msg': str(e)})
+
+
+@app.route('/upload/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    try:
+        return jsonify({'code': 0, 'msg': 'ok', 'data': uploads.status(upload_id)})
+    except Exception as e:
+        return jsonify({"code": 1, 'msg': str(e)})
+
+
+# 上传一个分片，请求体为分片原始字节，offset 为分片在文件中的位置，X-Chunk-Sha256 为分片校验值
+@app.route('/upload/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    try:
+        offset = uploads.write_chunk(
+            upload_id,
+            offset=_intparam(request.args.get('offset'), -1, minimum=-1),
+            length=request.content_length or 0,
+            stream=request.stream,
+            chunk_sha256=request.headers.get('X-Chunk-Sha256'))
+        return jsonify({'code': 0, 'msg': 'ok', 'data': {'offset': offset}})
+    except Exception as e:
+        logger.warning(f"Chunk upload to {upload_id} failed: {e}")
+        try:
+            # 返回服务器实际已接收的偏移量，客户端据此续传
+            return jsonify({"code": 5, 'msg': str(e), 'data': {'offset': uploads.status(upload_id)['offset']}})
+        except Exception:
+            return jsonify({"code": 1, 'msg': str(e)})
+
+
+# 全部分片上传后校验并保存，返回值与 /upload 或 /upload_video 相同
+@app.route('/upload/<upload_id>/complete', methods=['POST'])
+def upload_complete(upload_id):
+    data = request.get_json(silent=True) or {}
+    try:
+        meta = uploads.status(upload_id)
+        if meta['kind'] == 'audio':
+            filename = uploads.complete(upload_id, target=_audio_target(meta['filename']), sha256=data.get('sha256'))
+            logger.info(f"Uploaded audio file saved as {filename}.")
+            return jsonify({'code': 0, 'msg': 'ok', 'data': filename})
+        raw_file = uploads.complete(upload_id, target=_video_target(meta['filename']), sha256=data.get('sha256'))
+        logger.info(f"Saved raw video file to {raw_file}.")
+        return _upload_video_result(raw_file)
+    except Exception as e:
+        logger.error("Error during chunked upload complete:", exc_info=True)
+        return jsonify({"code": 1, 'msg': str(e)})
+
+
 def _checkparam(rate='0', pitch='0'):
     logger.debug(f"Checking parameters: rate={rate}, pitch={pitch}")
     try:
@@ -480,10 +586,137 @@ def _checkparam(rate='0', pitch='0'):
     return rate, pitch
 
 
+# 将请求中的数字参数转为 int，非法或为空时使用默认值
+def _intparam(value, default=0, minimum=0):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(minimum, value)
+
+
+# data 中 async 为真时提交为后台任务并立即返回任务 id，否则在当前请求线程中执行
+# 执行期间的指标按请求路由和模型名区分，后台任务沿用提交时的标签
+def _run_or_submit(job_type, func, data):
+    with metrics.labels(route=request.path, model=data.get('model_name') or ''):
+        if _intparam(data.get('async'), 0):
+            job = jobs.submit(job_type, _job_body, func, data)
+            return jsonify({"code": 0, "msg": "ok", "job_id": job.id})
+        return jsonify(_tracked(func, data))
+
+
+# 后台任务中执行 func，返回的 code 不为 0 时任务记为失败，原始结果仍可从 /job/<id>/result 取得
+def _job_body(func, data):
+    result = _tracked(func, data)
+    if result.get('code') != 0:
+        jobs.current().result = result
+        raise Exception(result.get('msg') or f"执行失败，code={result.get('code')}")
+    return result
+
+
+# 执行 func 并计入正在执行的请求数
+def _tracked(func, data):
+    metrics.IN_FLIGHT.inc()
+    try:
+        return func(data)
+    finally:
+        metrics.IN_FLIGHT.dec()
+
+
+# Prometheus 格式的运行指标
+@app.route('/metrics')
+def metrics_view():
+    metrics.TMP_DISK_BYTES.set(metrics.dir_size(TMP_DIR))
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/job/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"code": 1, "msg": "任务不存在"})
+    return jsonify({"code": 0, "msg": "ok", "data": job.to_dict()})
+
+
+# 当前打开的事件流数
+_sse_streams = 0
+_sse_lock = threading.Lock()
+
+
+def _sse_release():
+    global _sse_streams
+    with _sse_lock:
+        _sse_streams -= 1
+
+
+# 以 server-sent events 推送任务的阶段事件，断线重连时按 Last-Event-ID 续传，任务结束后关闭
+# 每个连接占用一个服务线程：同时打开的事件流超过 SSE_MAX_STREAMS 时返回 503 由客户端改为轮询，
+# 每个连接最长保持 SSE_MAX_SECONDS 秒后结束，客户端自动重连续传
+@app.route('/job/<job_id>/events')
+def job_events(job_id):
+    global _sse_streams
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"code": 1, "msg": "任务不存在"})
+    if request.headers.get('Last-Event-ID'):
+        since = _intparam(request.headers.get('Last-Event-ID')) + 1
+    else:
+        since = _intparam(request.args.get('since'))
+    with _sse_lock:
+        if _sse_streams >= SSE_MAX_STREAMS:
+            logger.info(f"Rejecting event stream for job {job_id}, {_sse_streams} streams open")
+            return jsonify({"code": 5, "msg": "事件流连接数已满，请轮询任务状态"}), 503
+        _sse_streams += 1
+
+    def generate(since):
+        deadline = time.time() + SSE_MAX_SECONDS
+        # 连接到期结束后 1 秒重连
+        yield 'retry: 1000\n\n'
+        while True:
+            remain = deadline - time.time()
+            if remain <= 0:
+                return
+            events = job.wait_events(since, timeout=min(15, remain))
+            if not events and job.finished:
+                return
+            if not events:
+                # 保持连接，防止代理或浏览器超时断开
+                yield ': keepalive\n\n'
+                continue
+            for it in events:
+                yield f"id: {it['id']}\ndata: {json.dumps(it, ensure_ascii=False)}\n\n"
+                if it['event'] == 'status' and it['status'] in ('done', 'failed'):
+                    return
+            since = events[-1]['id'] + 1
+
+    response = Response(stream_with_context(generate(since)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # 连接正常结束或客户端断开时都会调用
+    response.call_on_close(_sse_release)
+    return response
+
+
+# 任务完成后返回与同步请求相同格式的结果
+@app.route('/job/<job_id>/result')
+def job_result(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"code": 1, "msg": "任务不存在"})
+    if job.status == 'failed':
+        return jsonify(job.result or {"code": 2, "msg": job.error})
+    if job.status != 'done':
+        return jsonify({"code": 4, "msg": "任务未完成", "data": job.to_dict()})
+    return jsonify(job.result)
+
+
 @app.route('/zongjie', methods=['POST'])
 def zongjie():
-    logger.debug("Received request for video summarization.")
     data = request.get_json()
+    return _run_or_submit('zongjie', _zongjie, data)
+
+
+def _zongjie(data):
+    logger.debug("Received request for video summarization.")
     model_name = data.get('model_name')
     api_key = data.get('api_key')
     proxy = data.get('proxy')
@@ -491,33 +724,36 @@ def zongjie():
 
     if not all([api_key]):  # Include audio_filename in the check
         logger.warning("API key not provided for summarization.")
-        return jsonify({"code": 1, "msg": "必须输入api_key"})
+        return {"code": 1, "msg": "必须输入api_key"}
     if not video_file:
         logger.warning("Video file not provided for summarization.")
-        return jsonify({"code": 2, "msg": "视频文件必须要上传"})
+        return {"code": 2, "msg": "视频文件必须要上传"}
 
-    if proxy:
-        os.environ['https_proxy'] = proxy
-        logger.debug(f"Set HTTPS proxy to: {proxy}")
     try:
-        task = Gemini(model_name=model_name, api_key=api_key, audio_file=video_file)
+        _wait_video(video_file)
+        task = Gemini(model_name=model_name, api_key=api_key, audio_file=video_file, proxy=proxy)
         logger.debug("Initialized Gemini task for summarization.")
+        jobs.report('zongjie', message='生成视频总结')
         result = task.run_zongjie()
         if not result:
             logger.warning("No summary text generated.")
-            return jsonify({"code": 3, "msg": '无总结文本生成'})
+            return {"code": 3, "msg": '无总结文本生成'}
 
         logger.info("Summarization completed successfully.")
-        return jsonify({"code": 0, "msg": "ok", "data": result})
+        return {"code": 0, "msg": "ok", "data": result}
     except Exception as e:
         logger.exception("Error during summarization:", exc_info=True)
-        return jsonify({"code": 2, "msg": str(e)})
+        return {"code": 2, "msg": str(e)}
 
 
 @app.route('/jieshuo', methods=['POST'])
 def jieshuo():
-    logger.debug("Received request for video narration.")
     data = request.get_json()
+    return _run_or_submit('jieshuo', _jieshuo, data)
+
+
+def _jieshuo(data):
+    logger.debug("Received request for video narration.")
     model_name = data.get('model_name')
     api_key = data.get('api_key')
     proxy = data.get('proxy')
@@ -535,28 +771,28 @@ def jieshuo():
 
     if not all([api_key]):  # Include audio_filename in the check
         logger.warning("API key not provided for narration.")
-        return jsonify({"code": 1, "msg": "必须输入api_key"})
+        return {"code": 1, "msg": "必须输入api_key"}
     if not video_file:
         logger.warning("Video file not provided for narration.")
-        return jsonify({"code": 2, "msg": "视频文件必须要上传"})
+        return {"code": 2, "msg": "视频文件必须要上传"}
 
-    if proxy:
-        os.environ['https_proxy'] = proxy
-        logger.debug(f"Set HTTPS proxy to: {proxy}")
     try:
-        task = Gemini(model_name=model_name, api_key=api_key, audio_file=video_file)
+        _wait_video(video_file)
+        task = Gemini(model_name=model_name, api_key=api_key, audio_file=video_file, proxy=proxy)
         logger.debug("Initialized Gemini task for narration.")
+        jobs.report('jieshuo', message='生成解说文案')
         result = task.run_jieshuo()
         if not result:
             logger.warning("No narration script generated.")
-            return jsonify({"code": 3, "msg": '无解说文案生成'})
+            return {"code": 3, "msg": '无解说文案生成'}
         if autoend != 1:
             logger.debug("Autoend is not set to 1, returning narration result without video processing.")
-            return jsonify({"code": 0, "msg": "ok", "data": result})
+            return {"code": 0, "msg": "ok", "data": result}
 
         # 开始根据时间戳截取视频
         logger.debug("Starting video processing based on timestamps.")
-        tools.create_short_video(
+        jobs.report('render', message='生成短视频')
+        tts_failed = tools.create_short_video(
             video_path=video_file,
             time_list=result['timelist'],
             srt_str=result['srt'],
@@ -569,17 +805,21 @@ def jieshuo():
         video_url = '/tmp/' + str(Path(video_file).parent.stem) + '/shortvideo.mp4'
         logger.info(f"Video processing completed. Video URL: {video_url}")
         print(f'完成 {video_url=}')
-        return jsonify({"code": 0, "msg": "ok", "data": result, "url": video_url})
+        return {"code": 0, "msg": "ok", "data": result, "url": video_url, "tts_failed": tts_failed}
     except Exception as e:
         logger.exception("Error during narration:", exc_info=True)
-        return jsonify({"code": 2, "msg": str(e)})
+        return {"code": 2, "msg": str(e)}
 
 
 @app.route('/gocreate', methods=['POST'])
 def gocreate():
+    data = request.get_json()
+    return _run_or_submit('gocreate', _gocreate, data)
+
+
+def _gocreate(data):
     logger.debug("Received request for creating short video with dubbed subtitles.")
     # 开始根据时间戳截取视频
-    data = request.get_json()
     timelist = data.get('timelist')
     srt = data.get('srt')
     video_file = data.get('video_file')
@@ -592,7 +832,9 @@ def gocreate():
                  f"role={role}, insert_srt={insert_srt}, pitch={pitch}, rate={rate}")
     print(f'{rate=},{pitch=}')
     try:
-        tools.create_short_video(
+        _wait_video(video_file)
+        jobs.report('render', message='生成短视频')
+        tts_failed = tools.create_short_video(
             video_path=video_file,
             time_list=timelist,
             srt_str=srt,
@@ -605,62 +847,77 @@ def gocreate():
         video_url = '/tmp/' + str(Path(video_file).parent.stem) + '/shortvideo.mp4'
         logger.info(f"Short video created successfully. Video URL: {video_url}")
         print('完成')
-        return jsonify({"code": 0, "msg": "ok", "url": video_url})
+        return {"code": 0, "msg": "ok", "url": video_url, "tts_failed": tts_failed}
     except Exception as e:
         logger.error("Error during gocreate:", exc_info=True)
         import traceback
         print(traceback.format_exc())
-        return jsonify({"code": 1, "msg": str(e)})
+        return {"code": 1, "msg": str(e)}
 
 
 @app.route('/api', methods=['POST'])
 def api():
-    logger.debug("Received API request.")
     data = request.get_json()
+    return _run_or_submit('api', _api, data)
+
+
+def _api(data):
+    logger.debug("Received API request.")
     text = data.get('text')
     language = data.get('language')
     model_name = data.get('model_name')
     api_key = data.get('api_key')
     proxy = data.get('proxy')
     audio_file = data.get('audio_file')
+    piliang = _intparam(data.get('piliang'), 50, minimum=1)
+    waitsec = _intparam(data.get('waitsec'), 10)
+    concurrency = _intparam(data.get('concurrency'), TRANS_CONCURRENCY, minimum=1)
+    rpm = _intparam(data.get('rpm'), TRANS_RPM)
+    tpm = _intparam(data.get('tpm'), TRANS_TPM)
+    window = _intparam(data.get('window'), RECOGN_WINDOW)
+    overlap = _intparam(data.get('overlap'), RECOGN_OVERLAP)
 
     logger.debug(f"API parameters: text_present={'Yes' if text else 'No'}, language={language}, "
                  f"model_name={model_name}, api_key={'set' if api_key else 'not set'}, "
-                 f"proxy={'set' if proxy else 'not set'}, audio_file={audio_file}")
+                 f"proxy={'set' if proxy else 'not set'}, audio_file={audio_file}, piliang={piliang}, "
+                 f"waitsec={waitsec}, concurrency={concurrency}, rpm={rpm}, tpm={tpm}, window={window}, "
+                 f"overlap={overlap}")
 
     if not all([api_key]):  # Include audio_filename in the check
         logger.warning("API key not provided in API request.")
-        return jsonify({"code": 1, "msg": "必须输入api_key"})
+        return {"code": 1, "msg": "必须输入api_key"}
     if not text and not audio_file:
         logger.warning("Neither text nor audio_file provided in API request.")
-        return jsonify({"code": 2, "msg": "srt字幕文件和音视频文件必须要选择一个"})
+        return {"code": 2, "msg": "srt字幕文件和音视频文件必须要选择一个"}
 
-    if proxy:
-        os.environ['https_proxy'] = proxy
-        logger.debug(f"Set HTTPS proxy to: {proxy}")
     try:
         # logger.info(f'[API] 请求数据 {data=}')
         if text:
             logger.debug("Processing text translation via API.")
-            task = Gemini(text=text, language=language, model_name=model_name, api_key=api_key)
+            task = Gemini(text=text, language=language, model_name=model_name, api_key=api_key, piliang=piliang,
+                          waitsec=waitsec, concurrency=concurrency, rpm=rpm, tpm=tpm, proxy=proxy)
+            jobs.report('trans', message='翻译字幕')
             result = task.run_trans()
             if not result:
                 logger.warning("No translation result obtained from API.")
-                return jsonify({"code": 3, "msg": '无翻译结果'})
+                return {"code": 3, "msg": '无翻译结果'}
             logger.info("Text translation completed successfully.")
-            return jsonify({"code": 0, "msg": "ok", "data": result})
+            return {"code": 0, "msg": "ok", "data": result}
         # 视频转录
         logger.debug("Processing audio/video recognition via API.")
-        task = Gemini(text='', language=None if not language or language == '' else language, model_name=model_name,  api_key=api_key, audio_file=audio_file)
+        task = Gemini(text='', language=None if not language or language == '' else language, model_name=model_name,
+                      api_key=api_key, audio_file=audio_file, waitsec=waitsec, concurrency=concurrency, rpm=rpm,
+                      tpm=tpm, window=window, overlap=overlap, proxy=proxy)
+        jobs.report('recogn', message='转录音视频')
         result = task.run_recogn()
         if not result:
             logger.warning("No recognition result obtained from API.")
-            return jsonify({"code": 3, "msg": '没有识别出字幕'})
+            return {"code": 3, "msg": '没有识别出字幕'}
         logger.info("Audio/video recognition completed successfully.")
-        return jsonify({"code": 0, "msg": "ok", "data": result})
+        return {"code": 0, "msg": "ok", "data": result}
     except Exception as e:
         logger.exception("Error during API processing:", exc_info=True)
-        return jsonify({"code": 2, "msg": str(e)})
+        return {"code": 2, "msg": str(e)}
 
 
 def openurl(url):
@@ -681,7 +938,7 @@ if __name__ == '__main__':
         logger.info(f"Starting Flask app on http://{HOST}:{PORT}")
         print(f"api接口地址  http://{HOST}:{PORT}")
         openurl(f'http://{HOST}:{PORT}')
-        serve(app, host=HOST, port=PORT)
+        serve(app, host=HOST, port=PORT, threads=SERVER_THREADS)
     except Exception as e:
         logger.error(f"An error occurred: {str(e)}", exc_info=True)
         logger.error(traceback.format_exc())
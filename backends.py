@@ -0,0 +1,252 @@
+"""
+大模型后端
+
+各处对模型的调用只有四种：上传音视频、等待上传的文件处理完成、单次生成、以上传的文件为上下文对话。
+Backend 定义这四个操作，GeminiBackend 通过 clients 中的 Gemini 客户端实现；LocalBackend 是本地的确定性替身，
+按提示词返回与真实响应格式相同的内容，延迟可配置，并按概率注入 429、超时和内容被拦截，
+不需要 api_key 和网络即可压测服务的并发、限流和重试逻辑。使用哪个后端由 LLM_BACKEND 决定
+"""
+import random
+import re
+import threading
+import time
+import types
+from pathlib import Path
+
+from google.api_core import exceptions, retry
+from google.generativeai.types import RequestOptions
+
+from cfg import get_logger, LLM_BACKEND, LOCAL_LATENCY, LOCAL_JITTER, LOCAL_POLLS, LOCAL_ERROR_429, \
+    LOCAL_ERROR_TIMEOUT, LOCAL_ERROR_BLOCKED, LOCAL_SEED
+import cache
+import clients
+import metrics
+import subtitles
+import tools
+
+logger = get_logger('backends')
+
+
+class Backend:
+    name = ''
+
+    def __init__(self, client):
+        # client 提供 api_key、upload_file(file_path)、get_file(name)，供 cache 缓存上传结果和轮询文件状态
+        self.client = client
+
+    # 上传文件，相同 api_key 和内容的文件在有效期内复用已上传的远程文件
+    def upload(self, file_path):
+        return cache.upload_file(file_path, client=self.client)
+
+    # 等待远程文件处理完成，返回 ACTIVE 状态的远程文件
+    def wait_ready(self, remote):
+        return cache.wait_active(remote, client=self.client)
+
+    # 按名称取得已上传的远程文件
+    def get_file(self, name):
+        return self.client.get_file(name)
+
+    # 上传并等待处理完成
+    def prepare(self, file_path):
+        return self.wait_ready(self.upload(file_path))
+
+    # 单次生成，contents 为提示词或 [提示词, 远程文件, ...]，返回带 text、prompt_feedback、candidates 的响应
+    def generate(self, contents, *, timeout=None):
+        raise NotImplementedError
+
+    # 以 parts(远程文件等)作为用户的首条消息开始对话并发送 prompt，返回响应
+    def chat(self, parts, prompt, *, timeout=900):
+        raise NotImplementedError
+
+
+# SDK 内部重试前的回调，计入重试次数及其中的 429
+def _on_retry(error):
+    metrics.RETRIES.inc(kind='gemini')
+    if metrics.is_rate_limited(error):
+        metrics.RATE_LIMITED.inc(stage='generate')
+
+
+class GeminiBackend(Backend):
+    name = 'gemini'
+
+    def generate(self, contents, *, timeout=None):
+        # 只指定 timeout，保留默认的重试策略
+        return self.client.generate_content(contents, request_options={"timeout": timeout} if timeout else None)
+
+    # 与 ChatSession.send_message 发送的内容相同：parts 为首条用户消息，prompt 为第二条
+    def chat(self, parts, prompt, *, timeout=900):
+        return self.client.generate_content(
+            [{"role": "user", "parts": list(parts)}, {"role": "user", "parts": [prompt]}],
+            request_options=RequestOptions(
+                retry=retry.Retry(initial=10, multiplier=2, maximum=60, timeout=timeout, on_error=_on_retry),
+                timeout=timeout
+            )
+        )
+
+
+class _State:
+
+    def __init__(self, name):
+        self.name = name
+
+
+class LocalFile:
+
+    def __init__(self, name, path, polls):
+        self.name = name
+        self.path = path
+        self.display_name = Path(path).name
+        self.uri = f'local://{name}'
+        self.state = _State('PROCESSING' if polls > 0 else 'ACTIVE')
+        # 再查询多少次后变为 ACTIVE
+        self.polls = polls
+
+
+# 本地替身的文件接口，远程文件保存在进程内，所有替身共用
+class LocalClient:
+    _files = {}
+    _lock = threading.Lock()
+
+    def __init__(self, api_key, model_name, polls=1):
+        # 上传缓存以 api_key 区分，避免与 Gemini 的远程文件混用
+        self.api_key = f'local:{api_key}'
+        self.model_name = model_name
+        self.polls = polls
+
+    def upload_file(self, file_path):
+        with self._lock:
+            name = f'files/local-{len(self._files)}'
+            remote = LocalFile(name, Path(file_path).as_posix(), self.polls)
+            self._files[name] = remote
+        return remote
+
+    def get_file(self, name):
+        if '/' not in name:
+            name = f'files/{name}'
+        with self._lock:
+            remote = self._files.get(name)
+            if remote is None:
+                raise exceptions.NotFound(f'{name} 不存在')
+            remote.polls -= 1
+            if remote.polls <= 0:
+                remote.state = _State('ACTIVE')
+        return remote
+
+
+class LocalResponse:
+
+    def __init__(self, text, block_reason=0):
+        self._text = text
+        self.prompt_feedback = types.SimpleNamespace(block_reason=block_reason)
+        self.candidates = []
+
+    # 与 SDK 一致，内容被拦截时读取 text 抛出 ValueError
+    @property
+    def text(self):
+        if self.prompt_feedback.block_reason:
+            raise ValueError('The `response.text` quick accessor only works when the response contains a valid '
+                             '`Part`, but none was returned. Check the `response.prompt_feedback` to see if the '
+                             'prompt was blocked.')
+        return self._text
+
+
+# 所有本地替身共用一个随机数序列，种子相同、请求顺序相同时注入的错误相同
+_random = random.Random(LOCAL_SEED)
+_random_lock = threading.Lock()
+
+
+class LocalBackend(Backend):
+    name = 'local'
+
+    def __init__(self, api_key, model_name, *, latency=None, jitter=None, polls=None, error_429=None,
+                 error_timeout=None, error_blocked=None):
+        super().__init__(LocalClient(api_key, model_name, LOCAL_POLLS if polls is None else polls))
+        self.model_name = model_name
+        self.latency = LOCAL_LATENCY if latency is None else latency
+        self.jitter = LOCAL_JITTER if jitter is None else jitter
+        self.error_429 = LOCAL_ERROR_429 if error_429 is None else error_429
+        self.error_timeout = LOCAL_ERROR_TIMEOUT if error_timeout is None else error_timeout
+        self.error_blocked = LOCAL_ERROR_BLOCKED if error_blocked is None else error_blocked
+
+    # 模拟一次请求的耗时，并按概率注入错误，返回内容拦截原因(0 表示未拦截)
+    def _request(self, timeout):
+        with _random_lock:
+            delay = self.latency * (1 + self.jitter * (2 * _random.random() - 1))
+            roll = _random.random()
+        if roll < self.error_429:
+            raise exceptions.TooManyRequests('Resource has been exhausted (e.g. check quota). [local]')
+        roll -= self.error_429
+        if roll < self.error_timeout:
+            # 不实际等满请求时限，等待 2 倍延迟(不超过时限)后超时
+            time.sleep(max(0.0, min(delay * 2, timeout or delay * 2)))
+            raise exceptions.DeadlineExceeded('Deadline Exceeded [local]')
+        roll -= self.error_timeout
+        time.sleep(max(0.0, delay))
+        # 2 为 BlockReason.OTHER
+        return 2 if roll < self.error_blocked else 0
+
+    def generate(self, contents, *, timeout=None):
+        parts = contents if isinstance(contents, list) else [contents]
+        block_reason = self._request(timeout)
+        prompt = '\n'.join(it for it in parts if isinstance(it, str))
+        remote = next((it for it in parts if isinstance(it, LocalFile)), None)
+        if block_reason:
+            logger.debug(f"Local backend blocked prompt of {len(prompt)} chars")
+        return LocalResponse(self.respond(prompt, remote), block_reason)
+
+    def chat(self, parts, prompt, *, timeout=900):
+        return self.generate(list(parts) + [prompt], timeout=timeout)
+
+    # 按提示词中的输出标签判断请求类型，返回与真实响应格式相同的文本
+    def respond(self, prompt, remote):
+        # 提示词的说明文字中也有未闭合的 <INPUT>，待翻译的字幕在最后一个 <INPUT> 之后
+        match = re.search(r'.*<INPUT>(.*?)</INPUT>', prompt, re.S)
+        if match:
+            return (f'<step1_initial_translation>{match.group(1)}</step1_initial_translation>\n'
+                    f'<step2_reflection>-</step2_reflection>\n'
+                    f'<step3_refined_translation>{match.group(1)}</step3_refined_translation>')
+        duration = tools.get_video_ms(remote.path) / 1000 if remote else 0
+        if 'RECONGITION' in prompt.upper():
+            srt = make_srt(duration, '字幕')
+            trans = f'<TRANSLATE>{srt}</TRANSLATE>' if 'TRANSLATE' in prompt.upper() else ''
+            return f'<RECONGITION>{srt}</RECONGITION>{trans}'
+        time_list, total = make_time_list(duration)
+        if '<SRT>' in prompt.upper():
+            return f'<TIME>{time_list}</TIME>\n<SRT>{make_srt(total, "解说")}</SRT>'
+        if '<TIME>' in prompt.upper():
+            return f'<TIME>{time_list}</TIME>'
+        return f'视频时长 {int(duration)} 秒的总结'
+
+
+# 从 0 秒开始每 step 秒一条、共 seconds 秒的字幕
+def make_srt(seconds, label, step=3):
+    table = subtitles.SubtitleTable()
+    end_ms = max(int(seconds * 1000), 1000)
+    for i, start in enumerate(range(0, end_ms, step * 1000)):
+        table.append(start, max(start + 1, min(start + step * 1000, end_ms) - 100), f'{label} {i + 1}')
+    return table.to_srt()
+
+
+# 在 duration 秒内均匀选取的时间段，返回 ("00:00:01-00:00:06,...", 总秒数)，每段最长 length 秒
+def make_time_list(duration, length=5):
+    count = max(1, int(duration // 30))
+    spans = []
+    total = 0
+    for k in range(count):
+        start = int(k * duration / count) + 1
+        end = min(start + length, int(duration))
+        if end > start:
+            spans.append(f'{tools.seconds_to_time_str(start)[:8]}-{tools.seconds_to_time_str(end)[:8]}')
+            total += end - start
+    return ','.join(spans), total
+
+
+# 返回 api_key、模型和代理对应的后端，name 默认为 LLM_BACKEND
+def get(api_key, model_name, proxy=None, *, name=None):
+    name = name or LLM_BACKEND
+    if name == 'local':
+        return LocalBackend(api_key, model_name)
+    if name == 'gemini':
+        # 同一 api_key、模型和代理的请求复用客户端及其连接，代理只作用于该客户端
+        return GeminiBackend(clients.get(api_key, model_name, proxy))
+    raise Exception(f'不支持的模型后端 {name}，可选 gemini 或 local')
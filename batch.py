@@ -0,0 +1,213 @@
+"""
+批量处理
+
+输入目录中的每个文件依次经过 转码、上传、生成、渲染 等阶段，每个阶段有独立的线程池和并发数，
+文件完成一个阶段后立即进入下一阶段，因此渲染第 N 个文件时第 N+1 个可同时上传、第 N+2 个可同时转码。
+每个文件已完成的阶段及其结果记录在清单文件中，中断后重新运行时跳过已完成的阶段。
+VideoTask 和 video_stages 是 cut.py、jieshuo.py 共用的 以视频和提示词生成结果 的任务及其前三个阶段
+"""
+import copy
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from google.api_core.exceptions import ServerError, TooManyRequests, RetryError
+
+from cfg import get_logger, brief, BATCH_WORKERS
+import backends
+import cache
+import render
+
+logger = get_logger('batch')
+
+
+class Stage:
+
+    # func(file, data) 执行该阶段，data 为之前各阶段返回结果的合并，返回值(dict)合并进 data 并写入清单
+    def __init__(self, name, func, workers=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers or BATCH_WORKERS.get(name, 1))
+
+
+class BatchRunner:
+
+    def __init__(self, stages, *, manifest):
+        self.stages = stages
+        self._store = cache.JsonStore(manifest)
+        self._executors = {}
+        self._remain = 0
+        self._cond = threading.Condition()
+
+    # 文件在清单中的记录，文件大小或修改时间变化后从头处理
+    def _entry(self, file):
+        sig = render.file_signature(file)
+        entry = self._store.get(sig[0])
+        if not entry or entry.get('signature') != sig:
+            entry = {"signature": sig, "done": [], "data": {}, "error": None}
+        return entry
+
+    # 写入副本，避免其他文件的阶段线程修改记录时与写盘冲突
+    def _save(self, entry):
+        self._store.set(entry['signature'][0], copy.deepcopy(entry))
+
+    def _finish(self, file, entry):
+        status = f"failed: {entry['error']}" if entry['error'] else 'done'
+        logger.info(f"Batch file {file} {status}")
+        print(f'{Path(file).name} {status}')
+        with self._cond:
+            self._remain -= 1
+            self._cond.notify_all()
+
+    # 将文件提交到第 index 个未完成的阶段，全部完成时结束
+    def _advance(self, file, entry, index):
+        while index < len(self.stages) and self.stages[index].name in entry['done']:
+            logger.debug(f"Batch file {file} skips completed stage {self.stages[index].name}")
+            index += 1
+        if index >= len(self.stages):
+            self._finish(file, entry)
+            return
+        stage = self.stages[index]
+        self._executors[stage.name].submit(self._run_stage, file, entry, index)
+
+    def _run_stage(self, file, entry, index):
+        stage = self.stages[index]
+        start = time.time()
+        try:
+            result = stage.func(file, dict(entry['data'])) or {}
+        except Exception as e:
+            logger.error(f"Batch stage {stage.name} failed for {file}: {e}", exc_info=True)
+            entry['error'] = f'{stage.name}: {e}'
+            self._save(entry)
+            self._finish(file, entry)
+            return
+        entry['data'].update(result)
+        entry['done'].append(stage.name)
+        entry['error'] = None
+        self._save(entry)
+        logger.info(f"Batch stage {stage.name} for {file} took {time.time() - start:.2f}s")
+        self._advance(file, entry, index + 1)
+
+    # 处理全部文件，阻塞直到每个文件完成或失败，返回 {文件: 清单记录}
+    def run(self, files):
+        entries = {file: self._entry(file) for file in files}
+        for stage in self.stages:
+            self._executors[stage.name] = ThreadPoolExecutor(max_workers=stage.workers,
+                                                             thread_name_prefix=f'batch-{stage.name}')
+        logger.info(f"Batch processing {len(files)} files, stages: "
+                    + ', '.join(f'{it.name}x{it.workers}' for it in self.stages))
+        try:
+            with self._cond:
+                self._remain = len(files)
+            for file, entry in entries.items():
+                # 上次失败的阶段重新执行
+                entry['error'] = None
+                self._advance(file, entry, 0)
+            with self._cond:
+                self._cond.wait_for(lambda: self._remain <= 0)
+        finally:
+            for executor in self._executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
+        return entries
+
+
+# 上传视频并以提示词生成结果，tags 为 {结果键: 响应中的标签}，各标签的内容都不能为空
+class VideoTask:
+    prompt = ''
+    tags = {}
+
+    def __init__(self, api_key, model_name='gemini-1.5-flash', audio_file=None, proxy=None):
+        logger.debug(f"Initializing {type(self).__name__} with api_key={'set' if api_key else 'not set'}, "
+                     f"model_name={model_name}, audio_file={audio_file}, proxy={'set' if proxy else 'not set'}")
+        self.api_key = api_key
+        self.model_name = model_name
+        self.audio_file = audio_file
+        self.backend = backends.get(api_key, model_name, proxy)
+
+    # 转码为提交给 Gemini 的视频
+    def transcode(self):
+        self.audio_file = cache.transcode(self.audio_file, cache.VIDEO_TRANSCODE_ARGS, 'mp4')
+        logger.debug(f"Transcoded video file: {self.audio_file}")
+        return self.audio_file
+
+    # 上传到 Gemini 并等待处理完成，返回远程文件
+    def upload(self):
+        sample_audio = self.backend.upload(self.audio_file)
+        logger.debug(f"Uploaded video file: {self.audio_file}")
+        return self.backend.wait_ready(sample_audio)
+
+    # 根据已上传的视频生成结果，返回 {"timelist", "srt"}
+    def generate(self, sample_audio):
+        result = {"timelist": [], "srt": ""}
+        try:
+            response = self.backend.chat([sample_audio], self.prompt, timeout=900)
+
+            res_str = response.text.strip()
+            logger.info("Narration response: %s", brief(res_str))
+
+            for key, tag in self.tags.items():
+                match = re.search(rf'<{tag}>\**?(.*)\**?</{tag}>', res_str, re.I | re.S)
+                if match:
+                    result[key] = match.group(1).strip()
+                    logger.debug("Extracted %s: %s", tag, brief(result[key]))
+                if not result[key]:
+                    logger.error('Result is empty')
+                    raise Exception('Result is empty')
+            logger.debug("Narration completed successfully.")
+            return result
+        except (ServerError, RetryError, socket.timeout) as e:
+            logger.error("Unable to connect to Gemini, please try using or changing the proxy", exc_info=True)
+            raise Exception('Unable to connect to Gemini, please try using or changing the proxy') from e
+        except TooManyRequests as e:
+            logger.error("429 Too Many Requests", exc_info=True)
+            raise Exception('429 Too Many Requests') from e
+        except Exception as e:
+            logger.error("Exception occurred during narration:", exc_info=True)
+            raise
+
+    def run(self):
+        self.transcode()
+        return self.generate(self.upload())
+
+    # 使用之前阶段的转码结果，文件已被清理时重新转码
+    def restore_transcoded(self, transcoded):
+        if transcoded and Path(transcoded).is_file():
+            self.audio_file = transcoded
+            return self.audio_file
+        return self.transcode()
+
+    # 取得之前阶段上传的远程文件，已过期或不可用时重新上传
+    def restore_remote(self, name):
+        if name:
+            try:
+                return self.backend.wait_ready(self.backend.get_file(name))
+            except Exception as e:
+                logger.info(f"Uploaded file {name} is no longer available, uploading again: {e}")
+        return self.upload()
+
+
+# 转码、上传、生成、渲染四个阶段，make_task(video_file) 返回 VideoTask，render_func(video_file, data) 为渲染阶段
+# 转码后的文件和远程文件名写入清单，恢复时据此继续，不依赖转码和上传缓存仍然有效
+def video_stages(make_task, render_func):
+    def _transcode(video_file, data):
+        return {"transcoded": make_task(video_file).transcode()}
+
+    def _upload(video_file, data):
+        task = make_task(video_file)
+        task.restore_transcoded(data.get('transcoded'))
+        return {"transcoded": task.audio_file, "remote": task.upload().name}
+
+    def _generate(video_file, data):
+        task = make_task(video_file)
+        task.restore_transcoded(data.get('transcoded'))
+        return task.generate(task.restore_remote(data.get('remote')))
+
+    return [
+        Stage('transcode', _transcode),
+        Stage('upload', _upload),
+        Stage('generate', _generate),
+        Stage('render', render_func),
+    ]
@@ -0,0 +1,252 @@
+"""
+端到端基准测试
+
+用 ffmpeg lavfi 生成确定性的测试视频(彩条画面 + 每 10 秒静音 2 秒的正弦音)，以 local 模型后端按请求类型返回固定格式的响应，
+配音也由本地生成的正弦音代替，不需要 api_key 和网络。依次计时 run_recogn、run_trans、run_jieshuo、create_short_video(含 create_tts)、
+run_cut、create_cut_video 及其中的各阶段，结果写入 JSON 报告；指定 --baseline 时与之前的报告对比，耗时增加超过阈值的项视为性能回退
+
+每次运行使用空的缓存目录，--repeat 大于 1 时第 2 次起为命中缓存后的耗时
+
+python bench.py --durations 30,120 --sizes 640x360,1280x720 --repeat 2 --baseline bench/report-old.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import types
+from pathlib import Path
+
+API_KEY = 'bench-local'
+MODEL_NAME = 'gemini-1.5-flash'
+ROLE = 'zh-CN-YunxiNeural'
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='ai2srt 端到端基准测试')
+    parser.add_argument('--durations', default='30,120', help='测试视频时长(秒)，逗号分隔')
+    parser.add_argument('--sizes', default='640x360,1280x720', help='测试视频分辨率，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=1, help='每个场景运行次数')
+    parser.add_argument('--latency', type=float, default=0.0, help='local 模型后端每次生成请求的延迟秒数')
+    parser.add_argument('--out', default=None, help='报告文件路径，默认 bench/report-时间.json')
+    parser.add_argument('--baseline', default=None, help='用于对比的旧报告')
+    parser.add_argument('--threshold', type=float, default=0.2, help='耗时增加超过该比例视为性能回退')
+    parser.add_argument('--real-tts', action='store_true', help='使用 edge_tts 在线配音')
+    return parser.parse_args()
+
+
+args = _parse_args() if __name__ == '__main__' else None
+BENCH_DIR = Path(os.getcwd(), 'bench', datetime.datetime.now().strftime('%Y%m%d-%H%M%S')).as_posix()
+if args is not None:
+    # 须在导入 cfg 之前设置，各次基准测试从空缓存开始
+    os.environ.setdefault('CACHE_DIR', f'{BENCH_DIR}/cache')
+    # 基准测试只计时，不注入错误，延迟不浮动
+    os.environ.update({'LLM_BACKEND': 'local', 'LOCAL_LATENCY': str(args.latency), 'LOCAL_JITTER': '0',
+                       'LOCAL_ERROR_429': '0', 'LOCAL_ERROR_TIMEOUT': '0', 'LOCAL_ERROR_BLOCKED': '0'})
+
+from cfg import ROOT_DIR, FFMPEG_BIN, get_logger
+import tools
+import jobs
+import subtitles
+from backends import make_srt
+import app
+import cut
+
+logger = get_logger('bench')
+
+
+# 生成 duration 秒、分辨率为 size 的测试视频，相同参数的文件已存在时直接复用
+def make_media(out_dir, duration, size):
+    out = f'{out_dir}/media-{size}-{duration}s.mp4'
+    if Path(out).exists():
+        return out
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    cmd = [FFMPEG_BIN, '-y', '-v', 'error',
+           '-f', 'lavfi', '-i', f'testsrc2=size={size}:rate=25:duration={duration}',
+           '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={duration}',
+           # 每 10 秒中最后 2 秒静音，供按静音分段转录使用
+           '-af', "volume=volume=0:enable='gte(mod(t,10),8)'",
+           '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', '-shortest',
+           '-map_metadata', '-1', '-fflags', '+bitexact', '-flags:v', '+bitexact', '-flags:a', '+bitexact',
+           f'{out}.part.mp4']
+    subprocess.run(cmd, check=True)
+    os.replace(f'{out}.part.mp4', out)
+    return out
+
+
+# 代替 edge_tts.Communicate，按文本长度生成正弦音 mp3
+class LocalCommunicate:
+
+    def __init__(self, text, voice=None, rate=None, proxy=None, pitch=None):
+        self.text = text
+
+    async def save(self, file_path):
+        duration = min(0.15 * len(self.text) + 0.3, 10)
+        proc = await asyncio.create_subprocess_exec(
+            FFMPEG_BIN, '-y', '-v', 'error', '-f', 'lavfi',
+            '-i', f'sine=frequency=660:sample_rate=24000:duration={duration:.2f}', '-ac', '1', '-f', 'mp3', file_path)
+        if await proc.wait() != 0:
+            raise Exception(f'生成配音失败: {file_path}')
+
+
+# 在后台任务中执行 func，返回 (计时结果, 返回值)，各阶段耗时取自任务的阶段事件
+# 任务未抛出异常但 check(返回值) 给出错误信息时同样记为失败，避免把出错的结果计入耗时对比
+def timed(name, func, check=None):
+    job = jobs.submit('bench', func)
+    job.wait()
+    stages = {}
+    for it in job.events:
+        if it['event'] != 'end':
+            continue
+        stat = stages.setdefault(it['stage'], {"count": 0, "total": 0.0, "max": 0.0})
+        stat['count'] += 1
+        stat['total'] = round(stat['total'] + it['duration'], 3)
+        stat['max'] = max(stat['max'], it['duration'])
+    status, error = job.status, job.error
+    if status == 'done':
+        error = _result_error(job.result) or (check(job.result) if check else None)
+        if error:
+            status = 'failed'
+    result = {"scenario": name, "status": status, "error": error,
+              "wall": round(job.finished - job.started, 3), "stages": stages}
+    print(f"  {name:<20} {status:<6} {result['wall']:>8.3f}s  "
+          + ' '.join(f"{k}={v['total']}" for k, v in stages.items()))
+    return result, job.result
+
+
+# 与接口相同格式的返回值 {"code": ..., "msg": ...} 中 code 不为 0 时的错误信息
+def _result_error(value):
+    if isinstance(value, dict) and 'code' in value and value['code'] != 0:
+        return value.get('msg') or f"code={value['code']}"
+    return None
+
+
+def run_media(media, work_dir):
+    duration = tools.get_video_ms(media) / 1000
+    results = []
+
+    def _gemini(**kwargs):
+        return app.Gemini(api_key=API_KEY, model_name=MODEL_NAME, **kwargs)
+
+    # local 后端原样返回输入字幕，条数不一致说明提取或拼接出错
+    def _check_trans(translated):
+        expected, got = len(subtitles.loads(srt)), len(subtitles.loads(translated or ''))
+        if got != expected:
+            return f'翻译结果为 {got} 条字幕，输入为 {expected} 条'
+
+    # 返回值为配音失败的字幕
+    def _check_tts(tts_failed):
+        if tts_failed:
+            return f'{len(tts_failed)} 条字幕配音失败'
+
+    res, _ = timed('run_recogn', lambda: _gemini(text='', audio_file=media).run_recogn(),
+                   check=lambda value: None if value else '没有识别出字幕')
+    results.append(res)
+    srt = make_srt(duration, '字幕')
+    res, _ = timed('run_trans', lambda: _gemini(text=srt, language='English', waitsec=0).run_trans(),
+                   check=_check_trans)
+    results.append(res)
+    res, narration = timed('run_jieshuo', lambda: _gemini(audio_file=media).run_jieshuo(),
+                           check=lambda value: None if value else '无解说文案生成')
+    results.append(res)
+    if res['status'] == 'done':
+        res, _ = timed('create_short_video', lambda: tools.create_short_video(
+            video_path=media, time_list=narration['timelist'], srt_str=narration['srt'], role=ROLE,
+            ctx=tools.WorkContext(f'{work_dir}/short')), check=_check_tts)
+        results.append(res)
+    res, removal = timed('run_cut', lambda: cut.Gemini(API_KEY, MODEL_NAME, media).run_cut(),
+                         check=lambda value: None if value else '无裁剪结果')
+    results.append(res)
+    if res['status'] == 'done':
+        res, _ = timed('create_cut_video', lambda: tools.create_cut_video(
+            media, removal['timelist'], ctx=tools.WorkContext(f'{work_dir}/cut', tmp_dir=f'{work_dir}/cut/temp')))
+        results.append(res)
+    return results
+
+
+# 与旧报告对比，返回耗时增加超过 threshold 比例且超过 50ms 的项
+def compare(report, baseline, threshold):
+    def _index(rep):
+        items = {}
+        for it in rep['results']:
+            key = f"{it['size']} {it['duration']}s #{it['run']} {it['scenario']}"
+            items[key] = it['wall']
+            for stage, stat in it['stages'].items():
+                items[f'{key}.{stage}'] = stat['total']
+        return items
+
+    old, new = _index(baseline), _index(report)
+    regressions = []
+    for key, value in new.items():
+        if key not in old:
+            continue
+        before = old[key]
+        change = (value - before) / before if before > 0 else 0
+        flag = ''
+        if value - before > 0.05 and change > threshold:
+            flag = '  <-- 回退'
+            regressions.append({"item": key, "before": before, "after": value, "change": round(change, 3)})
+        print(f'{key:<60} {before:>9.3f} -> {value:>9.3f}  {change:+.1%}{flag}')
+    return regressions
+
+
+def main():
+    if not args.real_tts:
+        tools.edge_tts = types.SimpleNamespace(Communicate=LocalCommunicate)
+
+    durations = [int(it) for it in args.durations.split(',') if it.strip()]
+    sizes = [it.strip() for it in args.sizes.split(',') if it.strip()]
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec='seconds'),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "ffmpeg": _ffmpeg_version(),
+        "cpus": os.cpu_count(),
+        "config": {"durations": durations, "sizes": sizes, "repeat": args.repeat, "latency": args.latency,
+                   "real_tts": args.real_tts},
+        "results": [],
+    }
+    for size in sizes:
+        for duration in durations:
+            media = make_media(f'{BENCH_DIR}/media', duration, size)
+            for run in range(1, args.repeat + 1):
+                print(f'{size} {duration}s run {run}')
+                for it in run_media(media, f'{BENCH_DIR}/work/{size}-{duration}s'):
+                    report['results'].append({"size": size, "duration": duration, "run": run, **it})
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report['baseline'] = {"file": args.baseline, "threshold": args.threshold, "regressions": regressions}
+
+    out = args.out or f'{ROOT_DIR}/bench/report-{Path(BENCH_DIR).name}.json'
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'报告已保存到 {out}')
+    failed = [it for it in report['results'] if it['status'] != 'done']
+    return 1 if regressions or failed else 0
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=ROOT_DIR).stdout.strip()
+    except Exception:
+        return ''
+
+
+def _ffmpeg_version():
+    try:
+        return subprocess.run([FFMPEG_BIN, '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    except Exception:
+        return ''
+
+
+if __name__ == '__main__':
+    sys.exit(main())
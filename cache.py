@@ -0,0 +1,263 @@
+"""
+本地持久缓存
+
+上传到 Gemini 的文件按内容 hash 记录远程文件名和过期时间，重复操作同一文件时直接复用
+提交给 Gemini 前的转码结果按 源文件内容 hash + 转码参数 缓存，重复总结/解说同一视频时跳过重新编码
+配音片段按 文本 + 角色 + 语速 + 音调 缓存解码后的 PCM，重新生成视频时跳过合成和解码
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+from cfg import CACHE_DIR, TRANSCODE_CACHE_MAX_BYTES, TTS_CACHE_MAX_BYTES, FILE_POLL_INITIAL, FILE_POLL_MAX, \
+    FILE_ACTIVE_TIMEOUT, get_logger
+import tools
+import jobs
+
+logger = get_logger('cache')
+
+# Gemini 上传的文件 48 小时后过期，距过期不足该秒数时不再复用
+UPLOAD_EXPIRE_MARGIN = 3600
+
+TRANSCODE_DIR = f'{CACHE_DIR}/transcode'
+Path(TRANSCODE_DIR).mkdir(parents=True, exist_ok=True)
+TTS_DIR = f'{CACHE_DIR}/tts'
+Path(TTS_DIR).mkdir(parents=True, exist_ok=True)
+
+# 提交给 Gemini 识别的音频、视频转码参数
+AUDIO_TRANSCODE_ARGS = ['-ac', '1', '-ar', '8000']
+VIDEO_TRANSCODE_ARGS = ['-c:v', 'libx265', '-ac', '1', '-ar', '16000', '-preset', 'superfast']
+
+
+# 线程安全的 json 字典文件，每次修改后原子写入磁盘
+class JsonStore:
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+            logger.debug(f"Loaded {len(self._data)} entries from {path}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache file {path}: {e}")
+
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._save()
+
+    # 一次写入多个键，只写盘一次
+    def update(self, values):
+        with self._lock:
+            self._data.update(values)
+            self._save()
+
+    def pop(self, key):
+        with self._lock:
+            value = self._data.pop(key, None)
+            self._save()
+            return value
+
+    # 只保留 predicate(key) 为真的键，有删除时写盘一次，返回删除的个数
+    def retain(self, predicate):
+        with self._lock:
+            removed = [k for k in self._data if not predicate(k)]
+            for k in removed:
+                del self._data[k]
+            if removed:
+                self._save()
+            return len(removed)
+
+    def _save(self):
+        tmp = f'{self.path}.{os.getpid()}-{threading.get_ident()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+
+
+_upload_store = JsonStore(f'{CACHE_DIR}/uploads.json')
+# 配音缓存索引 {key: {"frame_rate", "text"}}
+_tts_store = JsonStore(f'{CACHE_DIR}/tts.json')
+# 同一缓存键同时只允许一个线程上传或转码，其他线程等待后直接复用结果
+_upload_locks = {}
+_transcode_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _key_lock(locks, key):
+    with _locks_lock:
+        if key not in locks:
+            locks[key] = threading.Lock()
+        return locks[key]
+
+
+# 上传文件到 Gemini，若相同内容已上传且远程文件仍可用，则直接返回远程文件
+def upload_file(file_path, *, client):
+    # 远程文件归属于 api_key 所在项目，缓存键需包含 key 的 hash；直接计算，不经过会记录日志的辅助函数
+    key_hash = hashlib.md5(client.api_key.encode('utf-8')).hexdigest()
+    key = f'{key_hash}-{tools.get_file_sha256(file_path)}'
+    with _key_lock(_upload_locks, key):
+        entry = _upload_store.get(key)
+        if entry and entry['expire'] > time.time() + UPLOAD_EXPIRE_MARGIN:
+            try:
+                remote = client.get_file(entry['name'])
+                if remote.state.name in ('ACTIVE', 'PROCESSING'):
+                    logger.info(f"Reusing uploaded file {remote.name} for {file_path}, state={remote.state.name}")
+                    jobs.report('upload', cached=True)
+                    return remote
+                logger.debug(f"Cached upload {entry['name']} is {remote.state.name}, uploading again")
+            except Exception as e:
+                logger.debug(f"Cached upload {entry['name']} is no longer available: {e}")
+            _upload_store.pop(key)
+
+        with jobs.stage('upload', size=Path(file_path).stat().st_size):
+            remote = client.upload_file(file_path)
+        logger.debug("Uploaded file: %s, response: %s", file_path, remote)
+        try:
+            expire = remote.expiration_time.timestamp()
+        except Exception:
+            expire = 0
+        if expire <= 0:
+            expire = time.time() + 47 * 3600
+        _upload_store.set(key, {"name": remote.name, "expire": expire, "file": Path(file_path).name})
+        return remote
+
+
+# 等待上传的文件处理完成并返回 ACTIVE 状态的远程文件
+# 轮询间隔从 initial 秒开始每次翻倍，最多 maximum 秒；状态为 FAILED 或超过 timeout 秒仍未完成时抛出异常
+def wait_active(remote, *, client, initial=None, maximum=None, timeout=None):
+    initial = initial or FILE_POLL_INITIAL
+    maximum = maximum or FILE_POLL_MAX
+    timeout = timeout or FILE_ACTIVE_TIMEOUT
+    start = time.time()
+    interval = initial
+    polls = 0
+    with jobs.stage('processing'):
+        while remote.state.name == "PROCESSING":
+            elapsed = time.time() - start
+            if elapsed > timeout:
+                raise Exception(f'文件 {remote.name} 处理超时，已等待 {int(elapsed)} 秒')
+            logger.debug("File %s is still processing. Waiting %ss...", remote.name, interval)
+            time.sleep(min(interval, timeout - elapsed))
+            interval = min(interval * 2, maximum)
+            polls += 1
+            remote = client.get_file(remote.name)
+    if remote.state.name != "ACTIVE":
+        raise Exception(f'文件 {remote.name} 处理失败，状态为 {remote.state.name}')
+    logger.info(f"File {remote.name} became ACTIVE after {time.time() - start:.2f}s and {polls} polls")
+    return remote
+
+
+# 转码 source 并缓存结果，返回缓存中的文件路径，调用方不可删除该文件
+def transcode(source, args, ext):
+    key = tools.get_md5(f'{tools.get_file_sha256(source)}-{json.dumps(args)}-{ext}')
+    target = f'{TRANSCODE_DIR}/{key}.{ext}'
+    with _key_lock(_transcode_locks, key):
+        if Path(target).is_file() and Path(target).stat().st_size > 0:
+            # 以修改时间作为最近使用时间
+            os.utime(target)
+            logger.info(f"Reusing transcoded file {target} for {source}")
+            jobs.report('transcode', cached=True)
+            return target
+        # 先写入临时文件再重命名，中途失败或中断不会留下不完整的缓存
+        tmp = f'{TRANSCODE_DIR}/{key}.{os.getpid()}-{threading.get_ident()}.part.{ext}'
+        try:
+            with jobs.stage('transcode'):
+                tools.runffmpeg(['ffmpeg', '-y', '-i', source] + args + [tmp])
+            os.replace(tmp, target)
+        finally:
+            Path(tmp).unlink(missing_ok=True)
+    logger.debug(f"Transcoded {source} to {target}")
+    _evict(TRANSCODE_DIR, TRANSCODE_CACHE_MAX_BYTES, keep=[target])
+    return target
+
+
+# 配音缓存键：文本去除首尾空白、合并连续空白并做 NFC 规范化，与角色、语速、音调一起计算 hash
+def tts_key(text, *, role, rate, pitch):
+    text = ' '.join(unicodedata.normalize('NFC', text).split())
+    return tools.get_md5(json.dumps([text, role, rate, pitch], ensure_ascii=False))
+
+
+# 返回缓存的单声道 16bit PCM 数组，未缓存或采样率不同时返回 None
+def get_tts(key, *, frame_rate):
+    entry = _tts_store.get(key)
+    target = f'{TTS_DIR}/{key}.npy'
+    if not entry or entry.get('frame_rate') != frame_rate:
+        return None
+    try:
+        samples = np.load(target, allow_pickle=False)
+    except Exception as e:
+        logger.debug(f"Cached TTS clip {key} is no longer available: {e}")
+        _tts_store.pop(key)
+        return None
+    os.utime(target)
+    return samples
+
+
+# 缓存一次配音新合成的全部片段，clips 为 [(key, PCM 数组, 文本)]
+# 索引只写盘一次，超出容量时的淘汰也只执行一次，避免片段数较多时反复重写索引和扫描目录
+def put_tts(clips, *, frame_rate):
+    entries = {}
+    for key, samples, text in clips:
+        tmp = f'{TTS_DIR}/{key}.{os.getpid()}-{threading.get_ident()}.part.npy'
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, samples, allow_pickle=False)
+            os.replace(tmp, f'{TTS_DIR}/{key}.npy')
+        finally:
+            Path(tmp).unlink(missing_ok=True)
+        entries[key] = {"frame_rate": frame_rate, "text": text[:100]}
+    if not entries:
+        return
+    _tts_store.update(entries)
+    kept = _evict(TTS_DIR, TTS_CACHE_MAX_BYTES, keep={f'{TTS_DIR}/{key}.npy' for key in entries})
+    # 去掉文件已被淘汰或删除的索引项，扫描后其他任务新写入的片段仍保留
+    removed = _tts_store.retain(lambda key: key in kept or Path(f'{TTS_DIR}/{key}.npy').exists())
+    if removed:
+        logger.debug(f"Removed {removed} stale TTS cache index entries")
+
+
+# 目录总大小超过 max_bytes 时，按修改时间从旧到新删除文件，keep 中的文件不删除
+# 返回保留下来的文件名(不含扩展名)集合
+def _evict(directory, max_bytes, keep=()):
+    keep = {Path(it).as_posix() for it in keep}
+    files = []
+    total = 0
+    for it in Path(directory).iterdir():
+        if not it.is_file() or '.part.' in it.name:
+            continue
+        st = it.stat()
+        files.append((st.st_mtime, st.st_size, it))
+        total += st.st_size
+    kept = {it.stem for _, _, it in files}
+    if total <= max_bytes:
+        return kept
+    files.sort(key=lambda x: x[0])
+    for mtime, size, it in files:
+        if total <= max_bytes:
+            break
+        if it.as_posix() in keep:
+            continue
+        try:
+            it.unlink()
+            total -= size
+            kept.discard(it.stem)
+            logger.info(f"Evicted cache file {it}, {size} bytes")
+        except Exception as e:
+            # 文件可能正被其他任务读取(Windows 下无法删除)，跳过
+            logger.warning(f"Failed to evict cache file {it}: {e}")
+    return kept
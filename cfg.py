@@ -2,29 +2,160 @@ import re,os,sys,datetime
 from datetime import timedelta
 
 from pathlib import Path
+import atexit
 import logging
+import logging.handlers
+import queue
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
 
 
 
 ROOT_DIR=Path(os.getcwd()).as_posix()
 TMP_DIR=f'{ROOT_DIR}/tmp'
+# 持久缓存目录，不放在 TMP_DIR 下以免被 /tmp 静态路由暴露
+CACHE_DIR=os.environ.get('CACHE_DIR', f'{ROOT_DIR}/cache')
 if sys.platform == 'win32':
     os.environ['PATH'] = ROOT_DIR + f';{ROOT_DIR}\\ffmpeg;' + os.environ['PATH']
 else:
     os.environ['PATH'] = ROOT_DIR + f':{ROOT_DIR}/ffmpeg:' + os.environ['PATH']
 Path(f'{TMP_DIR}').mkdir(parents=True, exist_ok=True)
 Path(f'{ROOT_DIR}/logs').mkdir(parents=True, exist_ok=True)
+Path(f'{CACHE_DIR}').mkdir(parents=True, exist_ok=True)
 
 # Set up logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
-
-_file_handler = logging.FileHandler(f'{ROOT_DIR}/logs/{datetime.datetime.now().strftime("%Y%m%d")}.log', encoding='utf-8')
-_file_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-_file_handler.setFormatter(formatter)
-logger.addHandler(_file_handler)
+# LOG_LEVEL 为默认级别，LOG_LEVELS 按模块单独设置，如 LOG_LEVELS=tools=DEBUG,cache=WARNING
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = dict(
+    it.split('=', 1) for it in os.environ.get('LOG_LEVELS', '').replace(' ', '').split(',') if '=' in it
+)
+# 日志中 响应文本、字幕、命令行 等大段内容最多保留的字符数
+LOG_PAYLOAD_MAX = int(os.environ.get('LOG_PAYLOAD_MAX', 2000))
+
+
+# 记录日志时不在调用线程中格式化和写盘：调用方只把日志记录放入队列，由后台线程格式化后写入控制台和文件
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+
+    # 默认实现会在调用线程中格式化消息，这里原样入队，参数在写出时才格式化
+    def prepare(self, record):
+        return record
+
+
+def _setup_logging():
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    console = logging.StreamHandler()
+    console.setFormatter(formatter)
+    file_handler = logging.FileHandler(f'{ROOT_DIR}/logs/{datetime.datetime.now().strftime("%Y%m%d")}.log',
+                                       encoding='utf-8')
+    file_handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, console, file_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger('ai2srt')
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_DeferredQueueHandler(log_queue))
+    root.propagate = False
+    for name, level in LOG_LEVELS.items():
+        root.getChild(name).setLevel(level.upper())
+    return root
+
+
+# 各模块的日志记录器，级别可通过 LOG_LEVELS 单独设置
+def get_logger(name):
+    return logging.getLogger('ai2srt').getChild(name)
+
+
+# 延迟截断大段内容，仅在日志实际写出时转为字符串，用法 logger.debug("response: %s", brief(text))
+class brief:
+
+    def __init__(self, value, limit=None):
+        self.value = value
+        self.limit = limit or LOG_PAYLOAD_MAX
+
+    def __str__(self):
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f'{text[:self.limit]}...({len(text)} chars)'
+
+
+logger = _setup_logging()
+
+# ffmpeg / ffprobe 可执行文件，默认从 PATH 中查找
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+FFPROBE_BIN = os.environ.get('FFPROBE_BIN', 'ffprobe')
+
+# 按 (api_key, 模型, 代理) 复用的 Gemini 客户端最多保留的个数
+GEMINI_CLIENTS_MAX = int(os.environ.get('GEMINI_CLIENTS_MAX', 32))
+
+# 大模型后端：gemini 为 Google Gemini；local 为本地确定性替身，不需要 api_key 和网络，用于压测服务的并发、限流和重试
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')
+# local 后端：每次生成请求的延迟秒数及上下浮动比例，上传的文件查询几次后处理完成，
+# 以及注入 429、超时、内容被拦截的概率(0-1)，随机数种子相同且请求顺序相同时注入的错误相同
+LOCAL_LATENCY = float(os.environ.get('LOCAL_LATENCY', 0))
+LOCAL_JITTER = float(os.environ.get('LOCAL_JITTER', 0.2))
+LOCAL_POLLS = int(os.environ.get('LOCAL_POLLS', 1))
+LOCAL_ERROR_429 = float(os.environ.get('LOCAL_ERROR_429', 0))
+LOCAL_ERROR_TIMEOUT = float(os.environ.get('LOCAL_ERROR_TIMEOUT', 0))
+LOCAL_ERROR_BLOCKED = float(os.environ.get('LOCAL_ERROR_BLOCKED', 0))
+LOCAL_SEED = int(os.environ.get('LOCAL_SEED', 0))
+
+# 等待 Gemini 上传的文件处理完成：首次轮询间隔秒数，间隔按倍数增长的上限，以及最长等待秒数
+FILE_POLL_INITIAL = float(os.environ.get('FILE_POLL_INITIAL', 1))
+FILE_POLL_MAX = float(os.environ.get('FILE_POLL_MAX', 15))
+FILE_ACTIVE_TIMEOUT = int(os.environ.get('FILE_ACTIVE_TIMEOUT', 900))
+
+# 转码缓存占用磁盘上限(字节)，超出后按最近使用时间淘汰
+TRANSCODE_CACHE_MAX_BYTES = int(os.environ.get('TRANSCODE_CACHE_MAX_BYTES', 20 * 1024 ** 3))
+# 配音片段缓存占用磁盘上限(字节)
+TTS_CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# 并行裁剪视频片段时每个 ffmpeg 进程的线程数，以及同时运行的进程数(0 表示按 CPU 核数/线程数自动计算)
+CUT_THREADS_PER_JOB = int(os.environ.get('CUT_THREADS_PER_JOB', 2))
+CUT_WORKERS = int(os.environ.get('CUT_WORKERS', 0))
+
+# 配音时同时进行的 edge_tts 请求数，单条配音的超时秒数及失败后的重试次数
+TTS_CONCURRENCY = int(os.environ.get('TTS_CONCURRENCY', 5))
+TTS_TIMEOUT = int(os.environ.get('TTS_TIMEOUT', 60))
+TTS_RETRIES = int(os.environ.get('TTS_RETRIES', 2))
+
+# 分片上传的分片大小，以及未完成的上传保留的秒数
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+UPLOAD_TTL = int(os.environ.get('UPLOAD_TTL', 2 * 24 * 3600))
+
+# 后台任务各类型的并发执行数，以及已完成任务保留的秒数
+JOB_WORKERS = {
+    "jieshuo": int(os.environ.get('JOB_WORKERS_JIESHUO', 2)),
+    "zongjie": int(os.environ.get('JOB_WORKERS_ZONGJIE', 2)),
+    "gocreate": int(os.environ.get('JOB_WORKERS_GOCREATE', 1)),
+    "api": int(os.environ.get('JOB_WORKERS_API', 4)),
+    "remux": int(os.environ.get('JOB_WORKERS_REMUX', 2)),
+}
+JOB_TTL = int(os.environ.get('JOB_TTL', 24 * 3600))
+
+# waitress 处理请求的线程数。任务事件流(SSE)每个连接占用一个线程，同时打开的事件流数至少比线程数少 4 个，
+# 超出时客户端改为轮询；每个事件流最长保持 SSE_MAX_SECONDS 秒，到期后客户端按 Last-Event-ID 重连续传
+SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 16))
+SSE_MAX_STREAMS = max(0, min(int(os.environ.get('SSE_MAX_STREAMS', 8)), SERVER_THREADS - 4))
+SSE_MAX_SECONDS = int(os.environ.get('SSE_MAX_SECONDS', 60))
+
+# 批量处理各阶段的并发数，某个文件完成一个阶段后立即进入下一阶段
+BATCH_WORKERS = {
+    "transcode": int(os.environ.get('BATCH_WORKERS_TRANSCODE', 2)),
+    "upload": int(os.environ.get('BATCH_WORKERS_UPLOAD', 2)),
+    "generate": int(os.environ.get('BATCH_WORKERS_GENERATE', 2)),
+    "render": int(os.environ.get('BATCH_WORKERS_RENDER', 1)),
+}
+
+# 字幕翻译默认并发请求数，以及每分钟请求数/token数上限，0 表示按 waitsec 推算请求间隔
+TRANS_CONCURRENCY = int(os.environ.get('TRANS_CONCURRENCY', 3))
+TRANS_RPM = int(os.environ.get('TRANS_RPM', 0))
+TRANS_TPM = int(os.environ.get('TRANS_TPM', 0))
+
+# 长音频转录时按静音处切分的每段目标秒数(0 表示整段提交)，以及相邻分段前后重叠的秒数
+RECOGN_WINDOW = int(os.environ.get('RECOGN_WINDOW', 900))
+RECOGN_OVERLAP = int(os.environ.get('RECOGN_OVERLAP', 3))
 
 
 safetySettings = [
@@ -0,0 +1,161 @@
+"""
+Gemini 客户端
+
+genai.configure 修改的是模块全局配置，不同 api_key 的并发请求会互相覆盖，且每次请求都重新建立连接。
+这里按 (api_key, model_name, proxy) 缓存相互独立的客户端，每个客户端持有自己的 gRPC 连接用于生成内容，
+上传和查询文件走 File API 的 HTTP 接口，按代理地址共用连接池。代理只作用于该客户端的连接，不修改进程环境变量
+"""
+import json
+import mimetypes
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+
+import requests
+from google.ai import generativelanguage_v1beta as glm
+from google.ai.generativelanguage_v1beta.services.generative_service.transports.grpc import \
+    GenerativeServiceGrpcTransport
+from google.api_core import exceptions
+from google.auth import api_key as api_key_credentials
+from google.generativeai.types import content_types, file_types, generation_types, safety_types
+
+from cfg import get_logger, safetySettings, GEMINI_CLIENTS_MAX
+
+logger = get_logger('clients')
+
+API_HOST = 'generativelanguage.googleapis.com'
+API_BASE = f'https://{API_HOST}'
+# File API 请求的 (连接, 读取) 超时秒数
+FILE_TIMEOUT = (30, 600)
+
+_clients = OrderedDict()
+_sessions = OrderedDict()
+_lock = threading.Lock()
+
+
+# 代理地址对应的 HTTP 会话，同一代理的客户端共用连接池；未指定代理时沿用系统环境变量中的代理
+# 最多保留 GEMINI_CLIENTS_MAX 个，淘汰的会话在仍持有它的客户端都释放后关闭连接池
+def _session(proxy):
+    with _lock:
+        session = _sessions.get(proxy)
+        if session is None:
+            session = requests.Session()
+            if proxy:
+                # 环境变量中的代理优先级高于 session.proxies，指定代理时不读取环境变量
+                session.trust_env = False
+                session.proxies = {"http": proxy, "https": proxy}
+            for adapter in session.adapters.values():
+                weakref.finalize(session, adapter.close)
+            _sessions[proxy] = session
+        _sessions.move_to_end(proxy)
+        while len(_sessions) > GEMINI_CLIENTS_MAX:
+            _sessions.popitem(last=False)
+        return session
+
+
+# 建立到 Gemini 的 gRPC 连接，指定代理时通过 grpc.http_proxy 只对该连接生效
+def _channel(api_key, proxy):
+    options = [("grpc.max_send_message_length", -1), ("grpc.max_receive_message_length", -1)]
+    if proxy:
+        options.append(("grpc.http_proxy", proxy))
+    return GenerativeServiceGrpcTransport.create_channel(f'{API_HOST}:443',
+                                                         credentials=api_key_credentials.Credentials(api_key),
+                                                         options=options)
+
+
+class GeminiClient:
+
+    def __init__(self, api_key, model_name, proxy=None):
+        self.api_key = api_key
+        self.model_name = model_name
+        self.proxy = proxy
+        self._session = _session(proxy)
+        channel = _channel(api_key, proxy)
+        # 直接调用 GenerativeServiceClient，请求由 SDK 的公开类型转换函数构造，不替换 GenerativeModel 的内部客户端
+        self._service = glm.GenerativeServiceClient(transport=GenerativeServiceGrpcTransport(channel=channel))
+        self._model = model_name if '/' in model_name else f'models/{model_name}'
+        self._safety_settings = safety_types.normalize_safety_settings(safetySettings)
+        # 被淘汰后仍可能有任务在使用，在最后一个引用释放时关闭 gRPC 连接，也可调用 close 立即关闭
+        self._closer = weakref.finalize(self, channel.close)
+
+    def close(self):
+        self._closer()
+
+    # 生成内容，contents 为提示词、[提示词, 远程文件, ...] 或带 role 的消息列表，request_options 为 RequestOptions
+    # 返回与 GenerativeModel.generate_content 相同的响应，未指定 role 的消息视为用户消息
+    def generate_content(self, contents, *, request_options=None):
+        request = glm.GenerateContentRequest(model=self._model, contents=content_types.to_contents(contents),
+                                             safety_settings=self._safety_settings)
+        for it in request.contents:
+            if not it.role:
+                it.role = 'user'
+        response = self._service.generate_content(request, **(request_options or {}))
+        return generation_types.GenerateContentResponse.from_response(response)
+
+    # 调用 File API，HTTP 错误转换为与 gRPC 调用相同的异常类型
+    def _request(self, method, url, **kwargs):
+        headers = {"x-goog-api-key": self.api_key, **kwargs.pop('headers', {})}
+        try:
+            response = self._session.request(method, url, headers=headers, timeout=FILE_TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            raise exceptions.ServiceUnavailable(f'File API 请求失败: {e}') from e
+        if response.status_code >= 400:
+            raise exceptions.from_http_response(response)
+        return response
+
+    @staticmethod
+    def _file(data):
+        return file_types.File(glm.File.from_json(json.dumps(data), ignore_unknown_fields=True))
+
+    # 以可恢复上传协议上传文件，返回远程文件
+    def upload_file(self, file_path):
+        path = Path(file_path)
+        mime_type = mimetypes.guess_type(path.as_posix())[0] or 'application/octet-stream'
+        size = os.path.getsize(path)
+        start = self._request('POST', f'{API_BASE}/upload/v1beta/files', headers={
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(size),
+            "X-Goog-Upload-Header-Content-Type": mime_type,
+        }, json={"file": {"display_name": path.name}})
+        with open(path, 'rb') as f:
+            response = self._request('POST', start.headers['X-Goog-Upload-URL'], headers={
+                "Content-Length": str(size),
+                "X-Goog-Upload-Offset": "0",
+                "X-Goog-Upload-Command": "upload, finalize",
+            }, data=f)
+        return self._file(response.json()['file'])
+
+    # 查询远程文件的最新状态
+    def get_file(self, name):
+        if '/' not in name:
+            name = f'files/{name}'
+        return self._file(self._request('GET', f'{API_BASE}/v1beta/{name}').json())
+
+
+# 返回 (api_key, model_name, proxy) 对应的客户端，首次使用时创建，超过 GEMINI_CLIENTS_MAX 个时淘汰最久未用的
+def get(api_key, model_name, proxy=None):
+    key = (api_key, model_name, proxy or None)
+    with _lock:
+        client = _clients.get(key)
+        if client is not None:
+            _clients.move_to_end(key)
+            return client
+    created = GeminiClient(api_key, model_name, proxy or None)
+    with _lock:
+        client = _clients.setdefault(key, created)
+        _clients.move_to_end(key)
+        evicted = []
+        while len(_clients) > GEMINI_CLIENTS_MAX:
+            evicted.append(_clients.popitem(last=False)[1])
+    # 其他线程已先创建了同一客户端
+    if client is not created:
+        created.close()
+    if evicted:
+        # 不再被任务引用的淘汰客户端在返回时释放并关闭连接，仍在使用的在任务结束后关闭
+        logger.debug(f"Evicted {len(evicted)} Gemini clients")
+    logger.debug(f"Using Gemini client for model_name={model_name}, proxy={'set' if proxy else 'not set'}")
+    return client
+
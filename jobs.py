@@ -0,0 +1,190 @@
+"""
+后台任务队列
+
+耗时的解说、总结、生成短视频、翻译转录请求提交后立即返回任务 id，实际工作在按任务类型划分的有界线程池中执行，
+客户端通过任务 id 查询状态、进度和结果，或通过 SSE 持续接收各阶段的开始、结束及耗时事件
+"""
+import contextlib
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from cfg import get_logger, JOB_WORKERS, JOB_TTL
+import metrics
+
+logger = get_logger('jobs')
+
+_jobs = {}
+_executors = {}
+_lock = threading.Lock()
+# 当前线程正在执行的任务，供深层代码上报进度
+_local = threading.local()
+
+
+class Job:
+
+    def __init__(self, job_type):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        # queued / running / done / failed
+        self.status = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # 按发生顺序记录的阶段事件，事件序号即列表下标
+        self.events = []
+        self._cond = threading.Condition()
+
+    # 记录一条事件，t 为距任务开始执行的秒数
+    def emit(self, event, **info):
+        with self._cond:
+            item = {"id": len(self.events), "event": event,
+                    "t": round(time.time() - (self.started or self.created), 3), **info}
+            self.events.append(item)
+            self._cond.notify_all()
+        return item
+
+    # 返回序号不小于 since 的事件，若暂无新事件则最多等待 timeout 秒
+    def wait_events(self, since, timeout=15):
+        with self._cond:
+            if len(self.events) <= since and self.finished is None:
+                self._cond.wait(timeout)
+            return self.events[since:]
+
+    # 等待任务结束，超时返回 False
+    def wait(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished is not None, timeout)
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            "id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "progress": self.progress,
+            "error": self.error,
+            "created": self.created,
+            "wait": round((self.started or now) - self.created, 3),
+            "elapsed": round((self.finished or now) - self.started, 3) if self.started else 0,
+        }
+
+
+def _get_executor(job_type):
+    if job_type not in _executors:
+        workers = JOB_WORKERS.get(job_type, 1)
+        logger.debug(f"Creating job executor for {job_type} with {workers} workers")
+        _executors[job_type] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f'job-{job_type}')
+    return _executors[job_type]
+
+
+# 清理完成超过 JOB_TTL 秒的任务，需在持有 _lock 时调用
+def _prune():
+    now = time.time()
+    for job_id in [k for k, v in _jobs.items() if v.finished and now - v.finished > JOB_TTL]:
+        del _jobs[job_id]
+
+
+def _run(job, func, args, kwargs):
+    metrics.JOBS_QUEUED.dec(type=job.type)
+    job.status = 'running'
+    job.started = time.time()
+    _local.job = job
+    job.emit('status', status='running', wait=round(job.started - job.created, 3))
+    logger.info(f"Job {job.id} ({job.type}) started after waiting {job.started - job.created:.2f}s")
+    try:
+        job.result = func(*args, **kwargs)
+        job.status = 'done'
+    except Exception as e:
+        logger.error(f"Job {job.id} ({job.type}) failed: {e}", exc_info=True)
+        job.error = str(e)
+        job.status = 'failed'
+        print(traceback.format_exc())
+    finally:
+        _local.job = None
+        job.emit('status', status=job.status, error=job.error)
+        with job._cond:
+            job.finished = time.time()
+            job._cond.notify_all()
+        logger.info(f"Job {job.id} ({job.type}) {job.status} in {job.finished - job.started:.2f}s")
+
+
+# 提交任务到 job_type 对应的线程池，立即返回 Job
+def submit(job_type, func, *args, **kwargs):
+    job = Job(job_type)
+    with _lock:
+        _prune()
+        _jobs[job.id] = job
+        executor = _get_executor(job_type)
+    metrics.JOBS_QUEUED.inc(type=job_type)
+    # 任务沿用提交时的 route、model 指标标签
+    executor.submit(bind(_run), job, func, args, kwargs)
+    logger.info(f"Submitted job {job.id} ({job_type})")
+    return job
+
+
+def get(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+# 当前线程所执行的任务，不在任务中执行时返回 None
+def current():
+    return getattr(_local, 'job', None)
+
+
+# 包装 func，使其在其他线程(如线程池)中执行时仍属于当前任务并沿用当前的指标标签
+def bind(func):
+    job = current()
+    labels = metrics.current_labels()
+
+    def _bound(*args, **kwargs):
+        prev_job, prev_labels = current(), metrics.current_labels()
+        _local.job = job
+        metrics.set_labels(labels)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.job = prev_job
+            metrics.set_labels(prev_labels)
+
+    return _bound
+
+
+# 上报当前任务进度，stage 为阶段名，其余为附加信息；不在任务中执行时忽略
+def report(stage, **info):
+    job = current()
+    if job is None:
+        return
+    job.progress = {"stage": stage, **info}
+    job.emit('progress', stage=stage, **info)
+    logger.debug("Job %s progress: %s", job.id, job.progress)
+
+
+# 计时一个流水线阶段，在当前任务中记录 start/end 事件及耗时，不在任务中执行时仅写日志，耗时同时计入指标
+@contextlib.contextmanager
+def stage(name, **info):
+    job = current()
+    start = time.time()
+    if job is not None:
+        job.progress = {"stage": name, **info}
+        job.emit('start', stage=name, **info)
+    try:
+        yield
+    except Exception as e:
+        duration = round(time.time() - start, 3)
+        logger.info(f"Stage {name} {info} failed after {duration}s")
+        metrics.observe_stage(name, duration, e)
+        if job is not None:
+            job.emit('error', stage=name, duration=duration, error=str(e), **info)
+        raise
+    duration = round(time.time() - start, 3)
+    logger.info(f"Stage {name} {info} took {duration}s")
+    metrics.observe_stage(name, duration)
+    if job is not None:
+        job.emit('end', stage=name, duration=duration, **info)
@@ -0,0 +1,223 @@
+"""
+运行指标
+
+以 Prometheus 文本格式在 /metrics 输出，不依赖 prometheus_client。
+各流水线阶段的耗时取自 jobs.stage，按阶段归入 ffmpeg、Gemini 或其他阶段的直方图；
+route、model 标签取自当前线程的请求上下文，由 app 在处理 /api、/jieshuo、/zongjie、/gocreate 请求时设置，
+任务线程池中的子线程通过 jobs.bind 继承，不在请求中执行(如命令行批量处理)时为空
+"""
+import contextlib
+import math
+import os
+import threading
+
+from cfg import get_logger
+
+logger = get_logger('metrics')
+
+# 秒级耗时的分桶上限
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+TTS_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)
+
+_registry = []
+_local = threading.local()
+
+
+# 当前线程的 route、model 等标签
+def current_labels():
+    return getattr(_local, 'labels', {})
+
+
+def set_labels(labels):
+    _local.labels = labels
+
+
+# 在 with 块内为当前线程设置标签，退出时恢复
+@contextlib.contextmanager
+def labels(**values):
+    prev = current_labels()
+    set_labels({**prev, **values})
+    try:
+        yield
+    finally:
+        set_labels(prev)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    # 未显式给出的标签从当前线程的标签中取
+    def _key(self, labels):
+        ctx = current_labels()
+        return tuple(str(labels.get(n, ctx.get(n, ''))) for n in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}' for k, v in
+                sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        return [f'{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}' for k, v in
+                sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # [各桶计数, 总和, 总数]
+            entry = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(total, 6))}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+FFMPEG_SECONDS = Histogram('ai2srt_ffmpeg_seconds', 'ffmpeg 转码、裁剪、拼接、合成等操作耗时(秒)',
+                           ('op', 'status', 'route', 'model'))
+GEMINI_SECONDS = Histogram('ai2srt_gemini_seconds', 'Gemini 上传、等待文件处理、生成耗时(秒)',
+                           ('op', 'status', 'route', 'model'))
+STAGE_SECONDS = Histogram('ai2srt_stage_seconds', '其他流水线阶段耗时(秒)', ('stage', 'status', 'route', 'model'))
+TTS_CLIP_SECONDS = Histogram('ai2srt_tts_clip_seconds', '单条配音耗时(秒)，含重试', ('status', 'route', 'model'),
+                             buckets=TTS_BUCKETS)
+TTS_CLIP_FAILURES = Counter('ai2srt_tts_clip_failures_total', '重试后仍失败的配音条数', ('route', 'model'))
+RATE_LIMITED = Counter('ai2srt_rate_limited_total', '收到 429 的次数', ('stage', 'route', 'model'))
+RETRIES = Counter('ai2srt_retries_total', '重试次数', ('kind', 'route', 'model'))
+IN_FLIGHT = Gauge('ai2srt_in_flight', '正在执行的请求及后台任务数', ('route', 'model'))
+JOBS_QUEUED = Gauge('ai2srt_jobs_queued', '排队等待执行的后台任务数', ('type',))
+TMP_DISK_BYTES = Gauge('ai2srt_tmp_disk_bytes', 'TMP_DIR 占用的磁盘空间(字节)')
+
+FFMPEG_STAGES = {'transcode', 'cut', 'concat', 'mux', 'remux', 'silence'}
+GEMINI_STAGES = {'upload', 'processing', 'generate'}
+
+
+# 记录 jobs.stage 的耗时，error 为阶段抛出的异常
+def observe_stage(name, duration, error=None):
+    status = 'ok' if error is None else 'error'
+    if name in FFMPEG_STAGES:
+        FFMPEG_SECONDS.observe(duration, op=name, status=status)
+    elif name in GEMINI_STAGES:
+        GEMINI_SECONDS.observe(duration, op=name, status=status)
+    else:
+        STAGE_SECONDS.observe(duration, stage=name, status=status)
+    if error is not None and is_rate_limited(error):
+        RATE_LIMITED.inc(stage=name)
+
+
+# google.api_core 的 TooManyRequests 及 HTTP 429 错误
+def is_rate_limited(error):
+    try:
+        return int(getattr(error, 'code', 0) or 0) == 429
+    except (TypeError, ValueError):
+        return False
+
+
+# 目录下所有文件的大小之和
+def dir_size(path):
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for it in entries:
+                try:
+                    if it.is_dir(follow_symlinks=False):
+                        stack.append(it.path)
+                    elif it.is_file(follow_symlinks=False):
+                        total += it.stat(follow_symlinks=False).st_size
+                except OSError:
+                    # 扫描期间被删除的文件
+                    continue
+    return total
+
+
+# 全部指标的 Prometheus 文本格式
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,61 @@
+"""
+增量渲染
+
+每个工作目录下的 render.json 记录各产物(裁剪片段、合并配音、最终视频)的输入摘要及生成时的文件大小和修改时间，
+再次生成时输入未变化且产物未被改动的步骤直接跳过，只重建受影响的产物
+"""
+import json
+import os
+from pathlib import Path
+
+from cfg import get_logger
+import tools
+import cache
+
+logger = get_logger('render')
+
+MANIFEST = 'render.json'
+
+
+# 源文件的签名，以路径、大小、修改时间代替读取整个大文件计算 hash
+def file_signature(file_path):
+    st = os.stat(file_path)
+    return [Path(file_path).resolve().as_posix(), st.st_size, st.st_mtime_ns]
+
+
+class RenderGraph:
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self._store = cache.JsonStore(f'{dirname}/{MANIFEST}')
+
+    # 输入字典的摘要
+    @staticmethod
+    def digest(inputs):
+        return tools.get_md5(json.dumps(inputs, ensure_ascii=False, sort_keys=True))
+
+    # 产物 output 是否由相同的 inputs 生成且之后未被改动
+    def is_fresh(self, name, inputs, output):
+        entry = self._store.get(name)
+        if not entry or entry['digest'] != self.digest(inputs):
+            return False
+        try:
+            st = os.stat(output)
+        except FileNotFoundError:
+            return False
+        fresh = entry['output'] == [Path(output).as_posix(), st.st_size, st.st_mtime_ns]
+        if fresh:
+            logger.debug(f"Render step {name} is up to date: {output}")
+        return fresh
+
+    # 产物生成成功后记录其输入摘要，返回摘要供下游步骤作为输入
+    def record(self, name, inputs, output):
+        st = os.stat(output)
+        digest = self.digest(inputs)
+        self._store.set(name, {"digest": digest, "output": [Path(output).as_posix(), st.st_size, st.st_mtime_ns]})
+        return digest
+
+    # 已记录的产物摘要，包含产物文件签名，产物重建后即使输入相同也会变化，未记录时返回 None
+    def get_digest(self, name):
+        entry = self._store.get(name)
+        return self.digest(entry) if entry else None
@@ -0,0 +1,133 @@
+"""
+字幕表
+
+字幕按列存储：开始、结束毫秒为两个整数数组，文本为字符串列表，第 i 条字幕的行号为 first_line + i。
+解析时逐行扫描一次，不为每条字幕创建字典，也不预先生成时间字符串，时间字符串在输出时才格式化；
+输出时逐条生成文本后一次拼接，写文件时逐条写出，文件再大也只占用字幕表本身的内存
+"""
+import io
+import re
+from array import array
+
+# 时间轴行，时和毫秒可省略，毫秒分隔符可为 , 或 .
+TIMING_RE = re.compile(r'^\s*(?:(\d+):)?(\d+):(\d+)(?:[,.](\d+))?\s*-->\s*(?:(\d+):)?(\d+):(\d+)(?:[,.](\d+))?')
+
+
+# 毫秒转为 时:分:秒,毫秒 格式
+def ms_to_srt_time(ms):
+    ms = max(0, int(ms))
+    s, ms = divmod(ms, 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return f'{h:02}:{m:02}:{s:02},{ms:03}'
+
+
+def _to_ms(h, m, s, ms):
+    return int(h or 0) * 3600000 + int(m) * 60000 + int(s) * 1000 + int(ms or 0)
+
+
+class SubtitleTable:
+
+    def __init__(self, first_line=1):
+        self.first_line = first_line
+        self.starts = array('q')
+        self.ends = array('q')
+        self.texts = []
+
+    def append(self, start, end, text):
+        self.starts.append(int(start))
+        self.ends.append(int(end))
+        self.texts.append(text)
+
+    def __len__(self):
+        return len(self.texts)
+
+    # 逐条返回 (开始毫秒, 结束毫秒, 文本)
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.texts)
+
+    def line(self, i):
+        return self.first_line + i
+
+    # 第 i 条字幕的时间轴 00:00:01,123 --> 00:00:12,345
+    def time(self, i):
+        return f'{ms_to_srt_time(self.starts[i])} --> {ms_to_srt_time(self.ends[i])}'
+
+    # 第 start 到 stop 条字幕组成的新表，保留原行号
+    def slice(self, start, stop):
+        table = SubtitleTable(self.first_line + start)
+        table.starts = self.starts[start:stop]
+        table.ends = self.ends[start:stop]
+        table.texts = self.texts[start:stop]
+        return table
+
+    def _blocks(self):
+        for i, text in enumerate(self.texts):
+            yield f'{self.first_line + i}\n{self.time(i)}\n{text}'
+
+    # 转为 srt 字符串，字幕之间以空行分隔
+    def to_srt(self):
+        return '\n\n'.join(self._blocks())
+
+    # 写入 srt 文件
+    def write(self, srt_file):
+        with open(srt_file, 'w', encoding='utf-8') as f:
+            for block in self._blocks():
+                f.write(block)
+                f.write('\n\n')
+
+    # 转为字典列表，兼容以 line/start_time/end_time/startraw/endraw/time/text 访问字幕的旧代码
+    def to_list(self):
+        result = []
+        for i, (start, end, text) in enumerate(self):
+            startraw, endraw = ms_to_srt_time(start), ms_to_srt_time(end)
+            result.append({"line": self.first_line + i, "start_time": start, "end_time": end, "startraw": startraw,
+                           "endraw": endraw, "time": f'{startraw} --> {endraw}', "text": text})
+        return result
+
+
+# 从逐行迭代的 srt 内容中解析字幕，未识别出任何时间轴行时返回空表
+# 每条字幕的文本为时间轴行到下一时间轴行之间的内容，去掉其后的空行和下一条的序号
+def parse(lines):
+    table = SubtitleTable()
+    timing = None
+    content = []
+
+    def _close(next_cue):
+        while content and not content[-1].strip():
+            content.pop()
+        # 下一条字幕的序号
+        if next_cue and len(content) > 1 and content[-1].strip().isdigit():
+            content.pop()
+        table.append(timing[0], timing[1], '\n'.join(content).strip())
+        content.clear()
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if '-->' in line:
+            m = TIMING_RE.match(line)
+            if m:
+                if timing is not None:
+                    _close(True)
+                timing = (_to_ms(*m.group(1, 2, 3, 4)), _to_ms(*m.group(5, 6, 7, 8)))
+                continue
+        if timing is not None:
+            content.append(line)
+    if timing is not None:
+        _close(False)
+    return table
+
+
+# 解析 srt 字符串
+def loads(content):
+    return parse(io.StringIO(content.lstrip('\ufeff')))
+
+
+# 逐行读取并解析 srt 文件，非 utf-8 编码时按 gbk 读取
+def load(srt_file):
+    try:
+        with open(srt_file, 'r', encoding='utf-8-sig') as f:
+            return parse(f)
+    except UnicodeDecodeError:
+        with open(srt_file, 'r', encoding='gbk') as f:
+            return parse(f)
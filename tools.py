@@ -8,16 +8,26 @@ import subprocess
 import sys
 import threading
 import time
-from datetime import timedelta
+import wave
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import edge_tts
 import shutil
+import numpy as np
 from pydub import AudioSegment
 
 # 根据时间戳截取视频片段
 from pydub.exceptions import CouldntDecodeError
 
-from cfg import TMP_DIR, ROOT_DIR, logger
+from cfg import TMP_DIR, ROOT_DIR, get_logger, brief, CUT_THREADS_PER_JOB, CUT_WORKERS, TTS_CONCURRENCY, \
+    TTS_TIMEOUT, TTS_RETRIES, FFMPEG_BIN, FFPROBE_BIN
+import jobs
+import metrics
+import cache
+import render
+import subtitles
+
+logger = get_logger('tools')
 
 
 # 所有裁剪的视频片段合并后的原始短视频
@@ -27,43 +37,79 @@ CAIJIAN_HEBING = 'cai-hebing.mp4'
 PEIYIN_HEBING = 'peiyin-hebing.wav'
 
 
-def create_short_video(video_path, time_list="", srt_str="", role="", pitch="+0Hz", rate="+0%", insert_srt=False):
-    logger.debug(f"Entering create_short_video with video_path={video_path}, time_list={time_list}, srt_str={srt_str}, role={role}, pitch={pitch}, rate={rate}, insert_srt={insert_srt}")
+# ctx 为本次渲染的上下文，未指定时以视频所在目录作为工作目录
+def create_short_video(video_path, time_list="", srt_str="", role="", pitch="+0Hz", rate="+0%", insert_srt=False,
+                       engine='filter', ctx=None):
+    logger.debug("Entering create_short_video with video_path=%s, time_list=%s, srt_str=%s, role=%s, pitch=%s, "
+                 "rate=%s, insert_srt=%s, engine=%s, ctx=%s", video_path, brief(time_list), brief(srt_str), role, pitch,
+                 rate, insert_srt, engine, ctx)
     # 创建工作目录
-    dirname = Path(video_path).parent.as_posix()
-    logger.debug(f"Creating directory: {dirname}")
-    Path(dirname).mkdir(parents=True, exist_ok=True)
+    ctx = ctx or WorkContext(Path(video_path).parent)
+    dirname = ctx.work_dir
+    logger.debug(f"Using work directory: {dirname}")
     
     srt_file = f'{dirname}/subtitle.srt'
     logger.debug(f"Writing SRT string to file: {srt_file}")
     with open(srt_file, 'w', encoding='utf-8') as f:
         f.write(srt_str)
     
-    # 根据时间片裁剪多个小片段
-    t_list = time_list.strip().split(',')
-    logger.debug(f"Parsed time list: {t_list}")
-    file_list = []
-    print(f'{t_list=}')
-    logger.debug(f"Starting video cutting process")
-    for i, it in enumerate(t_list):
-        tmp = it.split('-')
-        s = tmp[0]
-        e = tmp[1]
-        file_name = f'cai-{i}.mp4'
-        file_list.append(f"file '{file_name}'")
-        logger.debug(f"Cutting video segment {i}: start={s}, end={e}, output={dirname}/{file_name}")
-        cut_from_video(source=video_path, ss=s, to=e, out=f'{dirname}/{file_name}')
-    
     concat_txt_path = f'{dirname}/file.txt'
-    logger.debug(f"Writing concat list to file: {concat_txt_path}")
-    Path(concat_txt_path).write_text('\n'.join(file_list), encoding='utf-8')
-    
-    logger.debug(f"Concatenating video segments into {dirname}/{CAIJIAN_HEBING}")
-    concat_multi_mp4(out=f'{dirname}/{CAIJIAN_HEBING}', concat_txt=concat_txt_path)
+    # 记录各产物的输入，输入未变化的步骤直接复用上次的结果
+    graph = render.RenderGraph(dirname)
+    source_sig = render.file_signature(video_path)
+    cut_out = f'{dirname}/{CAIJIAN_HEBING}'
+    if engine == 'filter':
+        # 单个 ffmpeg 进程内截取所有片段并拼接，只经过一次解码编码
+        intervals = parse_time_list(time_list)
+        logger.debug("Parsed intervals: %s", brief(intervals))
+        cut_inputs = {"source": source_sig, "engine": engine, "intervals": intervals}
+        if graph.is_fresh('cut', cut_inputs, cut_out):
+            jobs.report('cut', cached=True)
+        else:
+            logger.debug(f"Cutting and concatenating {len(intervals)} segments into {cut_out}")
+            cut_concat_video(source=video_path, intervals=intervals, out=cut_out, ctx=ctx)
+            graph.record('cut', cut_inputs, cut_out)
+    else:
+        # 根据时间片裁剪多个小片段，只裁剪时间片或源视频有变化的片段
+        t_list = time_list.strip().split(',')
+        logger.debug("Parsed time list: %s", brief(t_list))
+        file_list = []
+        cut_jobs = []
+        clip_inputs = []
+        print(f'{t_list=}')
+        logger.debug(f"Starting video cutting process")
+        for i, it in enumerate(t_list):
+            tmp = it.split('-')
+            s = tmp[0]
+            e = tmp[1]
+            file_name = f'cai-{i}.mp4'
+            file_list.append(f"file '{file_name}'")
+            inputs = {"source": source_sig, "ss": s, "to": e}
+            if graph.is_fresh(f'cut-{i}', inputs, f'{dirname}/{file_name}'):
+                continue
+            logger.debug("Cutting video segment %s: start=%s, end=%s, output=%s/%s", i, s, e, dirname, file_name)
+            cut_jobs.append({"source": video_path, "ss": s, "to": e, "out": f'{dirname}/{file_name}'})
+            clip_inputs.append((i, inputs))
+        if cut_jobs:
+            cut_segments(cut_jobs, ctx=ctx)
+        for i, inputs in clip_inputs:
+            graph.record(f'cut-{i}', inputs, f'{dirname}/cai-{i}.mp4')
+
+        cut_inputs = {"engine": engine, "clips": [graph.get_digest(f'cut-{i}') for i in range(len(t_list))]}
+        if graph.is_fresh('cut', cut_inputs, cut_out):
+            jobs.report('concat', cached=True)
+        else:
+            logger.debug(f"Writing concat list to file: {concat_txt_path}")
+            Path(concat_txt_path).write_text('\n'.join(file_list), encoding='utf-8')
+
+            logger.debug(f"Concatenating video segments into {cut_out}")
+            concat_multi_mp4(out=cut_out, concat_txt=concat_txt_path, ctx=ctx)
+            graph.record('cut', cut_inputs, cut_out)
 
     # 开始配音
     logger.debug("Starting TTS creation")
-    create_tts(srt_file=srt_file, dirname=dirname, role=role, rate=rate, pitch=pitch, insert_srt=insert_srt)
+    tts_failed = create_tts(srt_file=srt_file, dirname=dirname, role=role, rate=rate, pitch=pitch,
+                            insert_srt=insert_srt, graph=graph, ctx=ctx)
     
     try:
         logger.debug(f"Removing temporary concat file: {concat_txt_path}")
@@ -72,229 +118,232 @@ def create_short_video(video_path, time_list="", srt_str="", role="", pitch="+0H
         logger.error(f"Error removing concat file: {e}")
     
     logger.debug("Exiting create_short_video")
+    # 配音失败的字幕行 [{"line", "error"}]，这些行在成片中为静音
+    return tts_failed
 
 
-# 创建配音
-def create_tts(*, srt_file, dirname, role="", rate='+0%', pitch="+0Hz", insert_srt=False):
+# 创建配音，返回配音失败的字幕行；合并配音和最终视频的输入未变化时跳过重新生成
+def create_tts(*, srt_file, dirname, role="", rate='+0%', pitch="+0Hz", insert_srt=False, graph=None, ctx=None):
+    ctx = ctx or WorkContext(dirname)
+    graph = graph or render.RenderGraph(dirname)
     logger.debug(f"Entering create_tts with srt_file={srt_file}, dirname={dirname}, role={role}, rate={rate}, pitch={pitch}, insert_srt={insert_srt}")
     queue_tts = get_subtitle_from_srt(srt_file, is_file=True)
-    logger.info(f'1 queue_tts={queue_tts}')
-    for i, it in enumerate(queue_tts):
-        queue_tts[i]['filename'] = f'{dirname}/peiyin-{i}.mp3'
-    logger.info(f'2 queue_tts={queue_tts}')
-
-    def _dubb(it):
-        logger.debug(f"Starting dubbing thread for: {it}")
-        async def _async_dubb(it):
-            logger.debug(f"Async dubbing for text: {it['text']}")
-            communicate_task = edge_tts.Communicate(
-                text=it["text"],
-                voice=role,
-                rate=rate,
-                proxy=None,
-                pitch=pitch)
-            await communicate_task.save(it['filename'])
-            logger.debug(f"Saved TTS audio to {it['filename']}")
-        
-        try:
-            asyncio.run(_async_dubb(it))
-        except Exception as e:
-            logger.error(f"Error in dubbing thread: {e}")
-
-    split_queue = [queue_tts[i:i + 5] for i in range(0, len(queue_tts), 5)]
-    logger.debug(f"Split queue into {len(split_queue)} batches")
-    for items in split_queue:
-        tasks = []
-        for it in items:
-            if it['text'].strip():
-                tasks.append(threading.Thread(target=_dubb, args=(it,)))
-        if len(tasks) < 1:
-            logger.debug("No tasks to process in this batch")
-            continue
-        logger.debug(f"Starting {len(tasks)} dubbing threads")
-        for t in tasks:
-            t.start()
-        for t in tasks:
-            t.join()
-        logger.debug("Completed dubbing threads for this batch")
-
-    # 连接所有音频片段
-    logger.debug("Starting to merge audio segments")
-    for i, it in enumerate(queue_tts):
-        the_ext = it['filename'].split('.')[-1]
-        raw = it['end_time'] - it['start_time']
-        if i > 0 and it['start_time'] < queue_tts[i-1]['end_time']:
-            diff = queue_tts[i-1]['end_time'] - it['start_time'] + 50
-            logger.debug(f"Adjusting timing for segment {i} by {diff}ms")
-            it['start_time'] += diff
-            it['end_time'] += diff
-        # 存在配音文件
-        if os.path.exists(it['filename']) and os.path.getsize(it['filename']) > 0:
+    starts, ends, texts = queue_tts.starts, queue_tts.ends, queue_tts.texts
+    # 每行字幕的配音缓存键及解码后的 PCM，空行为 None
+    tts_keys = [None] * len(queue_tts)
+    clip_samples = [None] * len(queue_tts)
+
+    with jobs.stage('tts', lines=len(queue_tts)):
+        # 已缓存的配音直接取解码后的 PCM，跳过合成和解码
+        pending = []
+        for i, text in enumerate(texts):
+            if not text.strip():
+                continue
+            tts_keys[i] = cache.tts_key(text, role=role, rate=rate, pitch=pitch)
+            clip_samples[i] = cache.get_tts(tts_keys[i], frame_rate=MIX_FRAME_RATE)
+            if clip_samples[i] is None:
+                pending.append({"index": i, "line": queue_tts.line(i), "text": text,
+                                "filename": f'{dirname}/peiyin-{i}.mp3'})
+        cached = len(queue_tts) - len(pending) - tts_keys.count(None)
+        logger.debug(f"TTS cache hits: {cached}/{len(queue_tts)}")
+        jobs.report('tts', cached=cached, total=len(queue_tts))
+        failures = synthesize_clips(pending, role=role, rate=rate, pitch=pitch)
+    if failures:
+        logger.warning(f"{len(failures)}/{len(queue_tts)} lines failed to synthesize, using silence instead: "
+                       + '; '.join(f"line {it['line']}: {it['tts_error']}" for it in failures))
+
+    with jobs.stage('mix', lines=len(queue_tts)):
+        # 新合成的配音文件只解码一次，全部解码后一次存入缓存
+        new_clips = []
+        for it in pending:
+            if it['tts_error'] or not os.path.exists(it['filename']) or os.path.getsize(it['filename']) == 0:
+                continue
             try:
-                logger.debug(f"Loading audio file: {it['filename']}")
-                seg_len = len(AudioSegment.from_file(it['filename'], format=the_ext))
-                logger.debug(f"Segment length: {seg_len}ms, raw duration: {raw}ms")
-                if seg_len > raw:
-                    offset = seg_len - raw
-                    logger.debug(f"Adjusting end_time by offset: {offset}ms")
-                    it['end_time'] += offset
+                samples = decode_audio(it['filename'], format='mp3')
             except CouldntDecodeError as e:
                 logger.error(f"Could not decode audio file {it['filename']}: {e}")
-        queue_tts[i] = it
-        logger.debug(f"Updated queue_tts[{i}] = {it}")
-
-    merged_audio = AudioSegment.empty()
-    logger.debug("Merging audio segments into a single track")
-    for i, it in enumerate(queue_tts):
-        if i == 0:
-            if it['start_time'] > 0:
-                logger.debug(f"Adding silence of {it['start_time']}ms before first audio segment")
-                merged_audio += AudioSegment.silent(duration=it['start_time'])
-        else:
-            dur = it['start_time'] - queue_tts[i-1]['end_time']
-            if dur > 0:
-                logger.debug(f"Adding silence of {dur}ms between segments {i-1} and {i}")
-                merged_audio += AudioSegment.silent(duration=dur)
-
-        if os.path.isfile(it['filename']) and os.path.getsize(it['filename']) > 0:
-            logger.debug(f"Adding audio file to merged_audio: {it['filename']}")
-            merged_audio += AudioSegment.from_file(it['filename'], format="mp3")
+                continue
+            new_clips.append((tts_keys[it['index']], samples, it['text']))
+            clip_samples[it['index']] = samples
+        cache.put_tts(new_clips, frame_rate=MIX_FRAME_RATE)
+
+        # 按配音时长调整时间轴后写入预分配的 PCM 缓冲区
+        logger.debug("Starting to merge audio segments")
+        clips = []
+        clip_keys = []
+        for i, samples in enumerate(clip_samples):
+            raw = ends[i] - starts[i]
+            if i > 0 and starts[i] < ends[i-1]:
+                diff = ends[i-1] - starts[i] + 50
+                starts[i] += diff
+                ends[i] += diff
+            if samples is not None:
+                seg_len = samples_to_ms(len(samples))
+                if seg_len > raw:
+                    ends[i] += seg_len - raw
+                clips.append((starts[i], samples))
+                clip_keys.append([starts[i], tts_keys[i]])
+            texts[i] = texts[i].replace('\n', '')
+        srt_str = queue_tts.to_srt()
+
+        shutil.copy2(dirname+'/subtitle.srt', dirname+'/subtitle00.srt')
+        logger.debug(f"Copied original subtitle to {dirname}/subtitle00.srt")
+        Path(dirname+'/subtitle.srt').write_text(srt_str, encoding='utf-8')
+        logger.debug("Updated subtitle.srt with merged SRT entries")
+
+        # 获取视频的长度毫秒，配音不足视频时长时以静音补齐
+        video_time = get_video_ms(f'{dirname}/{CAIJIAN_HEBING}', ctx=ctx)
+        logger.debug(f"Video duration: {video_time}ms")
+        audio_time = ends[-1] if queue_tts else 0
+        mix_inputs = {"clips": clip_keys, "duration": max(audio_time, video_time)}
+        if graph.is_fresh('mix', mix_inputs, f'{dirname}/{PEIYIN_HEBING}'):
+            jobs.report('mix', cached=True)
         else:
-            silence_duration = it['end_time'] - it['start_time']
-            logger.debug(f"Adding silence of {silence_duration}ms for missing audio file at segment {i}")
-            merged_audio += AudioSegment.silent(duration=silence_duration)
-
-    srts = []
-    logger.debug("Creating SRT entries for merged audio")
-    for i, it in enumerate(queue_tts):
-        srt_entry = f'{it["line"]}\n{ms_to_time_string(ms=it["start_time"])} --> {ms_to_time_string(ms=it["end_time"])}\n' + it["text"].replace('\n', '')
-        srts.append(srt_entry)
-        logger.debug(f"Created SRT entry: {srt_entry}")
-
-    shutil.copy2(dirname+'/subtitle.srt', dirname+'/subtitle00.srt')
-    logger.debug(f"Copied original subtitle to {dirname}/subtitle00.srt")
-    Path(dirname+'/subtitle.srt').write_text('\n\n'.join(srts), encoding='utf-8')
-    logger.debug("Updated subtitle.srt with merged SRT entries")
-
-    # 计算时长
-    audio_time = len(merged_audio)
-    logger.debug(f"Merged audio duration: {audio_time}ms")
-    # 获取视频的长度毫秒
-    video_time = get_video_ms(f'{dirname}/{CAIJIAN_HEBING}')
-    logger.debug(f"Video duration: {video_time}ms")
-    if audio_time < video_time:
-        logger.debug(f"Adding silence of {video_time - audio_time}ms to match video duration")
-        merged_audio += AudioSegment.silent(duration=video_time - audio_time)
-
-    merged_audio.export(f'{dirname}/{PEIYIN_HEBING}', format="wav")
-    logger.debug(f"Exported merged audio to {dirname}/{PEIYIN_HEBING}")
-
-    os.chdir(dirname)
-    logger.debug(f"Changed working directory to {dirname}")
-
-    tmp_wav = f"{dirname}/hunhe-{time.time()}.wav"
-    yuan_wav = f'{dirname}/yuan.wav'
-    logger.debug(f"Running ffmpeg to extract original audio to {yuan_wav}")
-    runffmpeg(['-y', '-i', f'{dirname}/{CAIJIAN_HEBING}', '-vn', yuan_wav])
-    
-    ffmpeg_cmd = [
-        '-y',
-        '-i',
-        yuan_wav,
-        '-i',
-        f'{dirname}/{PEIYIN_HEBING}',
-        '-filter_complex',
-        "[1:a]apad[a1];[0:a]volume=0.15[a0];[a0][a1]amerge=inputs=2[aout]",
-        '-map',
-        '[aout]',
-        tmp_wav
-    ]
-    logger.debug(f"Running ffmpeg to merge audio tracks into {tmp_wav}")
-    runffmpeg(ffmpeg_cmd)
-    
-    try:
-        logger.debug(f"Removing temporary original audio file: {yuan_wav}")
-        Path(yuan_wav).unlink(missing_ok=True)
-    except Exception as e:
-        logger.error(f"Error removing original audio file: {e}")
+            mix_timeline(clips, duration_ms=max(audio_time, video_time), out=f'{dirname}/{PEIYIN_HEBING}')
+            graph.record('mix', mix_inputs, f'{dirname}/{PEIYIN_HEBING}')
+            logger.debug(f"Exported merged audio to {dirname}/{PEIYIN_HEBING}")
+
+    # 单独调用 create_tts 时没有裁剪步骤的记录，以输入视频的签名代替，替换视频后重新合成
+    mux_inputs = {
+        "video": graph.get_digest('cut') or render.file_signature(f'{dirname}/{CAIJIAN_HEBING}'),
+        "voice": graph.get_digest('mix'),
+        "srt": get_md5(srt_str) if insert_srt else None,
+    }
+    if graph.is_fresh('mux', mux_inputs, f'{dirname}/shortvideo.mp4'):
+        jobs.report('mux', cached=True)
+    else:
+        with jobs.stage('mux'):
+            mux_short_video(video=f'{dirname}/{CAIJIAN_HEBING}', voice=f'{dirname}/{PEIYIN_HEBING}',
+                            out=f'{dirname}/shortvideo.mp4', srt_file=f'{dirname}/subtitle.srt' if insert_srt else None,
+                            ctx=ctx)
+        graph.record('mux', mux_inputs, f'{dirname}/shortvideo.mp4')
 
-    if insert_srt:
-        logger.debug("Inserting subtitles into the final video")
-        runffmpeg([
-            "-y",
-            "-i",
-            f'{dirname}/{CAIJIAN_HEBING}',
-            "-i",
-            f'{tmp_wav}',
-            "-i",
-            f'subtitle.srt',
-            "-map",
-            "0:v",
-            "-map",
-            "1:a",
-            "-map",
-            "2:s",
-            "-c:v",
-            "copy",
-            "-c:a",
-            "aac",
-            "-c:s",
-            "mov_text",
-            "-metadata:s:s:0",
-            f"language=chi",
-            '-af',
-            'volume=1.8',
-            "-shortest",  # 只处理最短的流（视频或音频）
-            f'{dirname}/shortvideo.mp4'
-        ])
+    logger.debug("Exiting create_tts")
+    return [{"line": it['line'], "error": it['tts_error']} for it in failures]
+
+
+# 在单个事件循环中为 items 配音，items 中每项需含 text 和 filename
+# 最多 concurrency 个请求同时进行，空闲的协程从队列中继续取下一条；单条超时或失败时按 1、2、4... 秒退避重试
+# 每项写入 tts_seconds、tts_attempts、tts_error(成功时为 None)，返回失败的项
+def synthesize_clips(items, *, role, rate='+0%', pitch='+0Hz', concurrency=None, timeout=None, retries=None):
+    concurrency = max(1, min(concurrency or TTS_CONCURRENCY, len(items) or 1))
+    timeout = timeout or TTS_TIMEOUT
+    retries = TTS_RETRIES if retries is None else retries
+    logger.debug(f"Synthesizing {len(items)} clips with concurrency={concurrency}, timeout={timeout}, retries={retries}")
+    done = 0
+
+    async def _synthesize(it):
+        start = time.time()
+        tmp = f"{it['filename']}.part"
+        it['tts_error'] = None
+        for attempt in range(retries + 1):
+            it['tts_attempts'] = attempt + 1
+            try:
+                communicate_task = edge_tts.Communicate(text=it["text"], voice=role, rate=rate, proxy=None, pitch=pitch)
+                await asyncio.wait_for(communicate_task.save(tmp), timeout)
+                os.replace(tmp, it['filename'])
+                it['tts_error'] = None
+                logger.debug(f"Saved TTS audio to {it['filename']}")
+                break
+            except Exception as e:
+                it['tts_error'] = 'timeout' if isinstance(e, asyncio.TimeoutError) else (str(e) or type(e).__name__)
+                logger.warning(f"TTS for line {it.get('line')} failed on attempt {attempt + 1}: {it['tts_error']}")
+                if attempt < retries:
+                    metrics.RETRIES.inc(kind='tts')
+                    await asyncio.sleep(2 ** attempt)
+        Path(tmp).unlink(missing_ok=True)
+        if it['tts_error']:
+            # 不使用上次生成的旧配音
+            Path(it['filename']).unlink(missing_ok=True)
+        it['tts_seconds'] = round(time.time() - start, 3)
+        metrics.TTS_CLIP_SECONDS.observe(it['tts_seconds'], status='error' if it['tts_error'] else 'ok')
+        if it['tts_error']:
+            metrics.TTS_CLIP_FAILURES.inc()
+
+    async def _worker(queue):
+        nonlocal done
+        while True:
+            try:
+                it = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await _synthesize(it)
+            done += 1
+            jobs.report('tts', line=it.get('line'), ok=it['tts_error'] is None, error=it['tts_error'],
+                        attempts=it['tts_attempts'], duration=it['tts_seconds'], done=done, total=len(items))
+
+    async def _run():
+        queue = asyncio.Queue()
+        for it in items:
+            queue.put_nowait(it)
+        await asyncio.gather(*[_worker(queue) for _ in range(concurrency)])
+
+    if items:
+        asyncio.run(_run())
+    return [it for it in items if it.get('tts_error')]
+
+
+# 在一个 ffmpeg 进程中合成最终视频：原声降低为 background 倍作为背景音，与配音合并后整体乘以 gain，
+# 复制视频流，srt_file 不为空时嵌入字幕轨
+def mux_short_video(*, video, voice, out, srt_file=None, background=0.15, gain=1.8, ctx=None):
+    logger.debug(f"Muxing {video} with {voice} into {out}, srt_file={srt_file}")
+    cmd = ['-y', '-i', video, '-i', voice]
+    if srt_file:
+        cmd += ['-i', srt_file]
+    if has_audio_stream(video, ctx=ctx):
+        audio_filter = (f"[0:a]volume={background}[a0];[1:a]apad[a1];"
+                        f"[a0][a1]amerge=inputs=2,volume={gain}[aout]")
     else:
-        logger.debug("Merging audio without inserting subtitles into the final video")
-        runffmpeg([
-            "-y",
-            "-i",
-            f'{dirname}/{CAIJIAN_HEBING}',
-            "-i",
-            f'{tmp_wav}',
-            "-map",
-            "0:v",
-            "-map",
-            "1:a",
-            "-c:v",
-            "copy",
-            "-c:a",
-            "aac",
-            '-af',
-            'volume=1.8',
+        audio_filter = f"[1:a]apad,volume={gain}[aout]"
+    cmd += ['-filter_complex', audio_filter, '-map', '0:v', '-map', '[aout]']
+    if srt_file:
+        cmd += ['-map', '2:s', '-c:s', 'mov_text', '-metadata:s:s:0', 'language=chi']
+    cmd += ['-c:v', 'copy', '-c:a', 'aac',
             "-shortest",  # 只处理最短的流（视频或音频）
-            f'{dirname}/shortvideo.mp4'
-        ])
-    
-    os.chdir(ROOT_DIR)
-    logger.debug(f"Changed working directory back to {ROOT_DIR}")
-    
-    try:
-        logger.debug(f"Removing temporary merged audio file: {tmp_wav}")
-        Path(tmp_wav).unlink(missing_ok=True)
-    except Exception as e:
-        logger.error(f"Error removing temporary merged audio file: {e}")
+            out]
+    return runffmpeg(cmd, ctx=ctx)
 
-    logger.debug("Exiting create_tts")
 
+# 一次渲染任务的上下文：工作目录、ffmpeg/ffprobe 可执行文件和临时目录
+# 外部命令以工作目录作为当前目录启动，相对路径按各自任务解析，不修改进程全局的当前目录，多个任务可在同一进程内并行
+class WorkContext:
 
-def runffprobe(cmd):
-    logger.debug(f"Running ffprobe with command: {cmd}")
+    def __init__(self, work_dir, *, ffmpeg=None, ffprobe=None, tmp_dir=None):
+        self.work_dir = Path(work_dir).resolve().as_posix()
+        self.ffmpeg = ffmpeg or FFMPEG_BIN
+        self.ffprobe = ffprobe or FFPROBE_BIN
+        self.tmp_dir = Path(tmp_dir).resolve().as_posix() if tmp_dir else f'{self.work_dir}/.tmp'
+        Path(self.work_dir).mkdir(parents=True, exist_ok=True)
+        Path(self.tmp_dir).mkdir(parents=True, exist_ok=True)
+
+    # 工作目录下的文件路径
+    def path(self, name):
+        return f'{self.work_dir}/{name}'
+
+    def __repr__(self):
+        return f'WorkContext({self.work_dir!r}, ffmpeg={self.ffmpeg!r}, tmp_dir={self.tmp_dir!r})'
+
+
+# 未指定上下文时使用，工作目录为程序目录
+DEFAULT_CONTEXT = WorkContext(ROOT_DIR, tmp_dir=TMP_DIR)
+
+
+def runffprobe(cmd, *, ctx=None):
+    ctx = ctx or DEFAULT_CONTEXT
+    logger.debug("Running ffprobe with command: %s, ctx=%s", brief(cmd), ctx)
     try:
         if Path(cmd[-1]).is_file():
             cmd[-1] = Path(cmd[-1]).as_posix()
-        p = subprocess.run(['ffprobe'] + cmd,
+        p = subprocess.run([ctx.ffprobe] + cmd,
                            stdout=subprocess.PIPE,
                            stderr=subprocess.PIPE,
                            encoding="utf-8",
                            text=True,
                            check=True,
+                           cwd=ctx.work_dir,
                            creationflags=0 if sys.platform != 'win32' else subprocess.CREATE_NO_WINDOW)
         if p.stdout:
-            logger.debug(f"ffprobe output: {p.stdout.strip()}")
+            logger.debug("ffprobe output: %s", brief(p.stdout.strip()))
             return p.stdout.strip()
         logger.error(f"ffprobe error: {p.stderr}")
         raise Exception(str(p.stderr))
@@ -304,16 +353,16 @@ def runffprobe(cmd):
 
 
 # 获取视频信息
-def get_video_ms(mp4_file):
+def get_video_ms(mp4_file, *, ctx=None):
     logger.debug(f"Getting video duration for file: {mp4_file}")
     mp4_file = Path(mp4_file).as_posix()
     out = runffprobe(
-        ['-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', mp4_file])
+        ['-v', 'quiet', '-print_format', 'json', '-show_format', '-show_streams', mp4_file], ctx=ctx)
     if out is False:
         logger.error('ffprobe error: did not get video information')
         raise Exception('ffprobe error: did not get video information')
     out = json.loads(out)
-    logger.debug(f"ffprobe JSON output: {out}")
+    logger.debug("ffprobe JSON output: %s", brief(out))
     if "streams" not in out or len(out["streams"]) < 1:
         logger.error('ffprobe error: streams is 0')
         raise Exception('ffprobe error: streams is 0')
@@ -326,16 +375,251 @@ def get_video_ms(mp4_file):
     return 0
 
 
-# 将字符串做 md5 hash处理
+# 判断媒体文件是否含有音频流
+def has_audio_stream(media_file, *, ctx=None):
+    out = runffprobe(['-v', 'quiet', '-print_format', 'json', '-show_streams', Path(media_file).as_posix()], ctx=ctx)
+    streams = json.loads(out).get('streams', [])
+    return any(it.get('codec_type') == 'audio' for it in streams)
+
+
+# 检测音频中的静音区间，返回 [(开始秒, 结束秒)]，末尾未结束的静音以 None 作为结束
+def detect_silences(media_file, *, noise='-30dB', min_duration=0.5, ctx=None):
+    ctx = ctx or DEFAULT_CONTEXT
+    cmd = [ctx.ffmpeg, '-hide_banner', '-nostats', '-i', Path(media_file).as_posix(), '-vn',
+           '-af', f'silencedetect=noise={noise}:d={min_duration}', '-f', 'null', '-']
+    logger.debug(f"Detecting silences with command: {cmd}")
+    p = subprocess.run(cmd,
+                       stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE,
+                       encoding="utf-8",
+                       errors="replace",
+                       text=True,
+                       cwd=ctx.work_dir,
+                       creationflags=0 if sys.platform != 'win32' else subprocess.CREATE_NO_WINDOW)
+    if p.returncode != 0:
+        logger.error(f"silencedetect error: {p.stderr}")
+        raise Exception(str(p.stderr))
+    silences = []
+    start = None
+    for line in p.stderr.splitlines():
+        m = re.search(r'silence_start:\s*(-?[\d.]+)', line)
+        if m:
+            start = max(0.0, float(m.group(1)))
+            continue
+        m = re.search(r'silence_end:\s*([\d.]+)', line)
+        if m and start is not None:
+            silences.append((start, float(m.group(1))))
+            start = None
+    if start is not None:
+        silences.append((start, None))
+    logger.debug(f"Detected {len(silences)} silences in {media_file}")
+    return silences
+
+
+# 将 duration 秒的音频划分为约 window 秒的分段，返回 [(开始秒, 结束秒)]
+# 分界点优先取 (开始 + window/2, 开始 + window] 内最靠后的静音中点，找不到时在 开始 + window 处硬切
+def plan_windows(duration, silences, window):
+    if window <= 0 or duration <= window:
+        return [(0.0, float(duration))]
+    points = []
+    for s, e in silences:
+        e = duration if e is None else e
+        points.append((s + e) / 2)
+    windows = []
+    start = 0.0
+    while duration - start > window:
+        ideal = start + window
+        candidates = [p for p in points if start + window / 2 < p <= ideal]
+        cut = max(candidates) if candidates else ideal
+        windows.append((start, cut))
+        start = cut
+    windows.append((start, float(duration)))
+    logger.debug("Planned %s windows for %ss audio: %s", len(windows), duration, brief(windows))
+    return windows
+
+
+# 将各分段的字幕拼接为整段字幕，parts 为 [(字幕字符串, 分段文件开始秒, 分段开始秒, 分段结束秒)]
+# 分段文件前后含有重叠部分，字幕时间加上分段文件的开始时间后，只保留中点落在 [分段开始, 分段结束) 内的行，
+# 以去除重叠区域中重复识别的字幕
+def stitch_srt(parts):
+    result = subtitles.SubtitleTable()
+    for srt_str, offset, start, end in parts:
+        if not srt_str or not srt_str.strip():
+            continue
+        offset_ms = int(offset * 1000)
+        for s, e, text in format_srt(srt_str.strip()):
+            s += offset_ms
+            e += offset_ms
+            if not start * 1000 <= (s + e) / 2 < end * 1000:
+                continue
+            text = text.strip()
+            # 分界点两侧仍可能各识别出同一句
+            if result and result.texts[-1] == text and s < result.ends[-1] + 1000:
+                result.ends[-1] = max(result.ends[-1], e)
+                continue
+            if result and s < result.ends[-1]:
+                s = result.ends[-1]
+                e = max(e, s)
+            result.append(s, e, text)
+    logger.debug(f"Stitched {len(parts)} parts into {len(result)} subtitles")
+    return get_srt_from_list(result)
+
+
+# 配音时间轴混音使用的采样率，edge_tts 输出即为 24kHz 单声道
+MIX_FRAME_RATE = 24000
+
+
+# 采样点数与毫秒互相换算
+def samples_to_ms(samples, frame_rate=MIX_FRAME_RATE):
+    return int(samples * 1000 / frame_rate)
+
+
+def ms_to_samples(ms, frame_rate=MIX_FRAME_RATE):
+    return int(ms * frame_rate / 1000)
+
+
+# 将音频文件解码为单声道 16bit PCM 的 numpy 数组
+def decode_audio(file_path, *, format=None, frame_rate=MIX_FRAME_RATE):
+    seg = AudioSegment.from_file(file_path, format=format)
+    seg = seg.set_channels(1).set_frame_rate(frame_rate).set_sample_width(2)
+    return np.frombuffer(seg.raw_data, dtype=np.int16)
+
+
+# 按时间轴混音：clips 为 [(开始毫秒, PCM 数组)]，在 duration_ms 长的静音缓冲区内将各片段叠加到对应位置，一次写出 wav
+# 片段超出缓冲区时延长缓冲区
+def mix_timeline(clips, *, duration_ms, out, frame_rate=MIX_FRAME_RATE):
+    total = ms_to_samples(duration_ms, frame_rate)
+    for start_ms, samples in clips:
+        total = max(total, ms_to_samples(start_ms, frame_rate) + len(samples))
+    logger.debug(f"Mixing {len(clips)} clips into {samples_to_ms(total, frame_rate)}ms timeline")
+    buffer = np.zeros(total, dtype=np.int32)
+    for start_ms, samples in clips:
+        pos = ms_to_samples(start_ms, frame_rate)
+        buffer[pos:pos + len(samples)] += samples
+    pcm = np.clip(buffer, -32768, 32767).astype(np.int16)
+    with wave.open(out, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(frame_rate)
+        f.writeframes(pcm.tobytes())
+    return out
+
+
+# 可直接复制进 mp4 容器的编码
+MP4_VIDEO_CODECS = {'h264', 'hevc', 'mpeg4', 'av1', 'vp9'}
+MP4_AUDIO_CODECS = {'aac', 'mp3', 'ac3', 'eac3', 'alac', 'opus', 'flac'}
+
+
+# 将任意容器的视频转为 mp4，仅探测一次：编码均兼容时整体复制流，否则只转码不兼容的流
+def remux_to_mp4(source, out, *, ctx=None):
+    out = Path(out)
+    out_part = out.with_name(f'{out.stem}.part{out.suffix}')
+    streams = json.loads(runffprobe(
+        ['-v', 'quiet', '-print_format', 'json', '-show_streams', Path(source).as_posix()], ctx=ctx)).get('streams', [])
+    video = [it.get('codec_name') for it in streams if it.get('codec_type') == 'video']
+    audio = [it.get('codec_name') for it in streams if it.get('codec_type') == 'audio']
+    if not video:
+        raise Exception('未找到视频流')
+    video_copy = video[0] in MP4_VIDEO_CODECS
+    audio_copy = all(it in MP4_AUDIO_CODECS for it in audio)
+    cmd = ['-y', '-i', Path(source).as_posix(), '-map', '0:v:0', '-map', '0:a?',
+           '-c:v', 'copy' if video_copy else 'libx264',
+           '-c:a', 'copy' if audio_copy else 'aac',
+           '-movflags', '+faststart', out_part.as_posix()]
+    with jobs.stage('remux', video=video[0], audio=','.join(audio), copy=video_copy and audio_copy):
+        try:
+            runffmpeg(cmd, ctx=ctx)
+            os.replace(out_part, out)
+        finally:
+            out_part.unlink(missing_ok=True)
+    logger.info(f"Remuxed {source} to {out}, video={'copy' if video_copy else 'libx264'}, "
+                f"audio={'copy' if audio_copy else 'aac'}")
+    return out.as_posix()
+
+
+# 将字符串做 md5 hash处理，输入可能含 api_key 等敏感内容，不写入日志
 def get_md5(input_string: str):
-    logger.debug(f"Generating MD5 for input string: {input_string}")
     md5 = hashlib.md5()
     md5.update(input_string.encode('utf-8'))
     md5_result = md5.hexdigest()
-    logger.debug(f"MD5 result: {md5_result}")
+    logger.debug("MD5 result: %s", md5_result)
     return md5_result
 
 
+# 文件内容 sha256，按 (路径, 大小, 修改时间) 在进程内缓存，避免重复读取大文件
+_file_hash_memo = {}
+_file_hash_lock = threading.Lock()
+
+
+def get_file_sha256(file_path):
+    st = os.stat(file_path)
+    memo_key = (Path(file_path).resolve().as_posix(), st.st_size, st.st_mtime_ns)
+    with _file_hash_lock:
+        if memo_key in _file_hash_memo:
+            return _file_hash_memo[memo_key]
+    logger.debug(f"Hashing file content: {file_path}")
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    result = sha.hexdigest()
+    with _file_hash_lock:
+        _file_hash_memo[memo_key] = result
+    logger.debug(f"sha256 of {file_path}: {result}")
+    return result
+
+
+# 粗略估算文本的 token 数：ASCII 约 4 字符一个 token，其他字符（中日韩等）按 1 字符一个 token
+def estimate_tokens(text: str):
+    ascii_num = sum(1 for c in text if ord(c) < 128)
+    return (ascii_num // 4) + (len(text) - ascii_num) + 1
+
+
+# 令牌桶限流器，同时限制每分钟请求数 rpm 和每分钟 token 数 tpm，值为 0 时不限制
+# 请求桶容量默认为 1，即请求按 60/rpm 秒均匀发出，避免瞬间突发触发 429
+class RateLimiter:
+
+    def __init__(self, *, rpm=0, tpm=0, burst=1):
+        logger.debug(f"Initializing RateLimiter with rpm={rpm}, tpm={tpm}, burst={burst}")
+        self.rpm = max(0, rpm)
+        self.tpm = max(0, tpm)
+        self.burst = max(1, burst)
+        self._req_tokens = float(self.burst)
+        self._tpm_tokens = float(self.tpm)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        if self.rpm > 0:
+            self._req_tokens = min(self.burst, self._req_tokens + elapsed * self.rpm / 60)
+        if self.tpm > 0:
+            self._tpm_tokens = min(self.tpm, self._tpm_tokens + elapsed * self.tpm / 60)
+
+    # 阻塞直到允许发送一个消耗 tokens 个 token 的请求
+    def acquire(self, tokens=1):
+        if self.tpm > 0:
+            tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0
+                if self.rpm > 0 and self._req_tokens < 1:
+                    wait = (1 - self._req_tokens) * 60 / self.rpm
+                if self.tpm > 0 and self._tpm_tokens < tokens:
+                    wait = max(wait, (tokens - self._tpm_tokens) * 60 / self.tpm)
+                if wait <= 0:
+                    if self.rpm > 0:
+                        self._req_tokens -= 1
+                    if self.tpm > 0:
+                        self._tpm_tokens -= tokens
+                    return
+            logger.debug("RateLimiter waiting %.2fs for tokens=%s", wait, tokens)
+            time.sleep(wait)
+
+
 # 获取程序执行目录
 def _get_executable_path():
     logger.debug("Getting executable path")
@@ -350,50 +634,42 @@ def _get_executable_path():
         return path
 
 
-# 将srt文件或合法srt字符串转为字典对象
-def get_subtitle_from_srt(srtfile, *, is_file=True):
-    logger.debug(f"Getting subtitles from {'file' if is_file else 'string'}: {srtfile}")
-    def _readfile(file):
-        logger.debug(f"Reading subtitle file: {file}")
-        content = ""
-        try:
-            with open(file, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-            logger.debug("Read subtitle file with utf-8 encoding")
-        except Exception as e:
-            logger.warning(f"Failed to read with utf-8 encoding: {e}")
-            try:
-                with open(file, 'r', encoding='gbk') as f:
-                    content = f.read().strip()
-                logger.debug("Read subtitle file with gbk encoding")
-            except Exception as e:
-                logger.error(f"Failed to read subtitle file with gbk encoding: {e}")
-                raise
-        return content
+# 读取字幕文件内容，非 utf-8 编码时按 gbk 读取
+def _read_srt_file(file):
+    try:
+        with open(file, 'r', encoding='utf-8-sig') as f:
+            return f.read().strip()
+    except UnicodeDecodeError as e:
+        logger.warning(f"Failed to read {file} with utf-8 encoding: {e}")
+        with open(file, 'r', encoding='gbk') as f:
+            return f.read().strip()
+
 
-    content = ''
+# 将srt文件或合法srt字符串转为字幕表，不是srt格式时按普通文本每行一条字幕
+def get_subtitle_from_srt(srtfile, *, is_file=True):
+    logger.debug(f"Getting subtitles from {'file ' + srtfile if is_file else 'string'}")
     if is_file:
-        content = _readfile(srtfile)
+        content = None
+        result = subtitles.load(srtfile)
     else:
         content = srtfile.strip()
+        result = subtitles.loads(content)
+    if len(result) > 0:
+        logger.debug(f"Parsed {len(result)} subtitles")
+        return result
 
+    if content is None:
+        content = _read_srt_file(srtfile)
     if len(content) < 1:
-        logger.error(f"srt is empty: srtfile={srtfile}, content={content}")
-        raise Exception(f"srt is empty: srtfile={srtfile}, content={content}")
-
+        logger.error(f"srt is empty: srtfile={srtfile if is_file else ''}")
+        raise Exception(f"srt is empty: srtfile={srtfile if is_file else ''}")
     result = format_srt(content)
-    logger.debug(f"Formatted subtitles: {result}")
 
     # txt 文件转为一条字幕
     if len(result) < 1:
         logger.debug("No valid subtitles found, creating a single subtitle entry")
-        result = [
-            {"line": 1,
-             "time": "00:00:00,000 --> 00:00:02,000",
-             "start_time": 0,
-             "end_time": 2000,
-             "text": "\n".join(content)}
-        ]
+        result = subtitles.SubtitleTable()
+        result.append(0, 2000, content)
     return result
 
 
@@ -405,26 +681,15 @@ print(ms_to_time_string(ms=12030))
 
 
 def ms_to_time_string(*, ms=0, seconds=None):
-    logger.debug(f"Converting to time string with ms={ms}, seconds={seconds}")
-    # 计算小时、分钟、秒和毫秒
-    if seconds is None:
-        td = timedelta(milliseconds=ms)
-    else:
-        td = timedelta(seconds=seconds)
-    hours, remainder = divmod(td.seconds, 3600)
-    minutes, seconds_part = divmod(remainder, 60)
-    milliseconds = td.microseconds // 1000
-
-    time_string = f"{hours}:{minutes}:{seconds_part},{milliseconds}"
-    formatted_time = format_time(time_string, ',')
-    logger.debug(f"Formatted time string: {formatted_time}")
-    return formatted_time
+    if seconds is not None:
+        ms = round(seconds * 1000)
+    return subtitles.ms_to_srt_time(ms)
 
 
 # 将不规范的 时:分:秒,|.毫秒格式为  aa:bb:cc,ddd形式
 # eg  001:01:2,4500  01:54,14 等做处理
 def format_time(s_time="", separate=','):
-    logger.debug(f"Formatting time string: s_time={s_time}, separate={separate}")
+    logger.debug("Formatting time string: s_time=%s, separate=%s", s_time, separate)
     if not s_time.strip():
         logger.debug("Empty time string provided, returning default")
         return f'00:00:00{separate}000'
@@ -449,20 +714,20 @@ def format_time(s_time="", separate=','):
     sec = f'{int(sec):02}'
     ms = f'{int(ms):03}'[-3:]
     formatted = f"{hou}:{min}:{sec}{separate}{ms}"
-    logger.debug(f"Formatted time: {formatted}")
+    logger.debug("Formatted time: %s", formatted)
     return formatted
 
 
 # 将 datetime.timedelta 对象的秒和微妙转为毫秒整数值
 def toms(td):
     ms = (td.seconds * 1000) + int(td.microseconds / 1000)
-    logger.debug(f"Converting timedelta to ms: {td} -> {ms}ms")
+    logger.debug("Converting timedelta to ms: %s -> %sms", td, ms)
     return ms
 
 
 # 将 时:分:秒,毫秒 转为毫秒整数值
 def get_ms_from_hmsm(time_str):
-    logger.debug(f"Converting time string to ms: {time_str}")
+    logger.debug("Converting time string to ms: %s", time_str)
     h, m, sec2ms = 0, 0, '00,000'
     tmp0 = time_str.split(":")
     if len(tmp0) == 3:
@@ -475,30 +740,13 @@ def get_ms_from_hmsm(time_str):
     sec = tmp[0]
 
     total_ms = int(int(h) * 3600000 + int(m) * 60000 + int(sec) * 1000 + int(ms))
-    logger.debug(f"Converted {time_str} to {total_ms}ms")
+    logger.debug("Converted %s to %sms", time_str, total_ms)
     return total_ms
 
 
 # 合法的srt字符串转为 dict list
 def srt_str_to_listdict(content):
-    import srt
-    logger.debug("Parsing SRT string to list of dictionaries")
-    line = 0
-    result = []
-    for sub in srt.parse(content):
-        line += 1
-        it = {
-            "start_time": toms(sub.start),
-            "end_time": toms(sub.end),
-            "line": line,
-            "text": sub.content
-        }
-        it['startraw'] = ms_to_time_string(ms=it['start_time'])
-        it['endraw'] = ms_to_time_string(ms=it['end_time'])
-        it["time"] = f"{it['startraw']} --> {it['endraw']}"
-        result.append(it)
-        logger.debug(f"Added subtitle entry: {it}")
-    return result
+    return subtitles.loads(content).to_list()
 
 
 # 判断是否是srt字符串
@@ -538,7 +786,7 @@ def process_text_to_srt_str(input_text: str):
 
     # 将文本按换行符切割成列表
     text_lines = [line.strip() for line in input_text.replace("\r", "").splitlines() if line.strip()]
-    logger.debug(f"Split input text into lines: {text_lines}")
+    logger.debug("Split input text into lines: %s", brief(text_lines))
 
     # 分割大于50个字符的行
     text_str_list = []
@@ -547,11 +795,11 @@ def process_text_to_srt_str(input_text: str):
             # 按标点符号分割为多个字符串
             split_lines = re.split(r'[,.，。]', line)
             split_lines = [l.strip() for l in split_lines if l.strip()]
-            logger.debug(f"Splitting long line into: {split_lines}")
+            logger.debug("Splitting long line into: %s", brief(split_lines))
             text_str_list.extend(split_lines)
         else:
             text_str_list.append(line)
-    logger.debug(f"Processed text lines: {text_str_list}")
+    logger.debug("Processed text lines: %s", brief(text_str_list))
 
     # 创建字幕字典对象列表
     dict_list = []
@@ -566,30 +814,29 @@ def process_text_to_srt_str(input_text: str):
         # 创建字幕字典对象
         srt = f"{i}\n{start_time} --> {end_time}\n{text}"
         dict_list.append(srt)
-        logger.debug(f"Created SRT entry: {srt}")
+        logger.debug("Created SRT entry: %s", brief(srt))
 
     srt_str = "\n\n".join(dict_list)
-    logger.debug(f"Final SRT string:\n{srt_str}")
+    logger.debug("Final SRT string:\n%s", brief(srt_str))
     return srt_str
 
 
-# 将字符串或者字幕文件内容，格式化为有效字幕数组对象
+# 将字符串或者字幕文件内容，格式化为有效字幕表
 # 格式化为有效的srt格式
 def format_srt(content):
-    logger.debug("Formatting SRT content")
-    result = []
-    try:
-        result = srt_str_to_listdict(content)
-        logger.debug("Successfully parsed SRT content")
-    except Exception as e:
-        logger.warning(f"Failed to parse SRT content directly: {e}. Attempting to process as plain text")
-        result = srt_str_to_listdict(process_text_to_srt_str(content))
+    result = subtitles.loads(content)
+    if len(result) < 1:
+        logger.debug("No SRT timing lines found, processing as plain text")
+        result = subtitles.loads(process_text_to_srt_str(content))
     return result
 
 
 # 将字幕字典列表写入srt文件
 def save_srt(srt_list, srt_file):
     logger.debug(f"Saving SRT list to file: {srt_file}")
+    if isinstance(srt_list, subtitles.SubtitleTable):
+        srt_list.write(srt_file)
+        return True
     txt = get_srt_from_list(srt_list)
     with open(srt_file, "w", encoding="utf-8") as f:
         f.write(txt)
@@ -606,16 +853,15 @@ def get_current_time_as_yymmddhhmmss(format='hms'):
     return current_time
 
 
-# 从 字幕 对象中获取 srt 字幕串
+# 从 字幕表 或 字幕字典列表 中获取 srt 字幕串
 def get_srt_from_list(srt_list):
-    logger.debug("Generating SRT string from list of subtitle dictionaries")
-    txt = ""
-    line = 0
+    if isinstance(srt_list, subtitles.SubtitleTable):
+        return srt_list.to_srt() + '\n\n' if len(srt_list) else ''
+    blocks = []
     # it中可能含有完整时间戳 it['time']   00:00:01,123 --> 00:00:12,345
     # 开始和结束时间戳  it['startraw']=00:00:01,123  it['endraw']=00:00:12,345
     # 开始和结束毫秒数值  it['start_time']=126 it['end_time']=678
-    for it in srt_list:
-        line += 1
+    for line, it in enumerate(srt_list, start=1):
         if "startraw" not in it:
             # 存在完整开始和结束时间戳字符串 时:分:秒,毫秒 --> 时:分:秒,毫秒
             if 'time' in it:
@@ -633,25 +879,23 @@ def get_srt_from_list(srt_list):
             # 存在单独开始和结束  时:分:秒,毫秒 字符串
             startraw = it['startraw']
             endraw = it['endraw']
-        srt_entry = f"{line}\n{startraw} --> {endraw}\n{it['text']}\n\n"
-        txt += srt_entry
-        logger.debug(f"Added SRT entry: {srt_entry}")
-    return txt
+        blocks.append(f"{line}\n{startraw} --> {endraw}\n{it['text']}\n\n")
+    return ''.join(blocks)
 
 
-def runffmpeg(cmd):
-    logger.debug(f"Running ffmpeg with command: {cmd}")
-    import subprocess
+def runffmpeg(cmd, *, ctx=None):
+    ctx = ctx or DEFAULT_CONTEXT
+    logger.debug("Running ffmpeg with command: %s, ctx=%s", brief(cmd), ctx)
     try:
-        if cmd[0] != 'ffmpeg':
-            cmd.insert(0, 'ffmpeg')
-        logger.info(f"ffmpeg command: {cmd}")
+        cmd = [ctx.ffmpeg] + (cmd[1:] if cmd[0] == 'ffmpeg' else cmd)
+        logger.info("ffmpeg command: %s", brief(cmd))
         subprocess.run(cmd,
                        stdout=subprocess.PIPE,
                        stderr=subprocess.PIPE,
                        encoding="utf-8",
                        check=True,
                        text=True,
+                       cwd=ctx.work_dir,
                        creationflags=0 if sys.platform != 'win32' else subprocess.CREATE_NO_WINDOW)
         logger.debug("ffmpeg command executed successfully")
     except Exception as e:
@@ -662,8 +906,8 @@ def runffmpeg(cmd):
 
 
 # 从视频中切出一段时间的视频片段 cuda + h264_cuvid
-def cut_from_video(*, ss="", to="", source="", out=""):
-    logger.debug(f"Cutting video from {source}: ss={ss}, to={to}, out={out}")
+def cut_from_video(*, ss="", to="", source="", out="", threads=None, ctx=None):
+    logger.debug(f"Cutting video from {source}: ss={ss}, to={to}, out={out}, threads={threads}")
     cmd1 = [
         "-y",
         "-ss",
@@ -671,16 +915,113 @@ def cut_from_video(*, ss="", to="", source="", out=""):
     if to != '':
         cmd1.append("-to")
         cmd1.append(format_time(to, '.'))  # 如果开始结束时间相同，则强制持续时间1s)
+    # 限制解码和编码线程数，并行裁剪时避免多个进程抢占全部核心
+    if threads:
+        cmd1 += ['-threads', str(threads)]
     cmd1.append('-i')
     cmd1.append(source)
+    if threads:
+        cmd1 += ['-threads', str(threads)]
 
     cmd = cmd1 + [f'{out}']
-    logger.debug(f"ffmpeg cut_from_video command: {cmd}")
-    result = runffmpeg(cmd)
+    logger.debug("ffmpeg cut_from_video command: %s", brief(cmd))
+    result = runffmpeg(cmd, ctx=ctx)
     logger.debug(f"Completed cutting video to {out}")
     return result
 
 
+# 不重新编码，从音频中复制出 start 到 end 秒的片段
+def cut_audio(*, source, start, end, out, ctx=None):
+    logger.debug(f"Cutting audio from {source}: start={start}, end={end}, out={out}")
+    return runffmpeg(['-y', '-ss', f'{start:.3f}', '-t', f'{end - start:.3f}', '-i', Path(source).as_posix(),
+                      '-vn', '-c', 'copy', '-map_metadata', '-1', Path(out).as_posix()], ctx=ctx)
+
+
+# 解析 "00:00:10-00:00:20,00:01:00-00:01:30" 形式的时间片列表为 [(开始秒, 结束秒)]
+def parse_time_list(time_list):
+    intervals = []
+    for it in time_list.strip().split(','):
+        if not it.strip():
+            continue
+        tmp = it.split('-')
+        start = time_str_to_seconds(format_time(tmp[0], '.'))
+        end = time_str_to_seconds(format_time(tmp[1], '.'))
+        if end <= start:
+            logger.warning(f"Skipping empty time slice: {it}")
+            continue
+        intervals.append((start, end))
+    logger.debug("Parsed time list into intervals: %s", brief(intervals))
+    return intervals
+
+
+# 在一次 ffmpeg 调用中从 source 截取多个片段并拼接为 out
+# 每个片段作为一个以 -ss/-t 定位的输入，只解码所需区间，再经 concat 滤镜拼接后编码一次
+def cut_concat_video(*, source, intervals, out, ctx=None):
+    logger.debug(f"Cutting {len(intervals)} segments from {source} into {out}")
+    if not intervals:
+        logger.error('No valid time slices to cut')
+        raise Exception('No valid time slices to cut')
+    has_audio = has_audio_stream(source, ctx=ctx)
+    cmd = ['-y']
+    filters = []
+    concat_in = ''
+    for i, (start, end) in enumerate(intervals):
+        cmd += ['-ss', f'{start:.3f}', '-t', f'{end - start:.3f}', '-i', source]
+        filters.append(f'[{i}:v]setpts=PTS-STARTPTS[v{i}]')
+        concat_in += f'[v{i}]'
+        if has_audio:
+            filters.append(f'[{i}:a]asetpts=PTS-STARTPTS[a{i}]')
+            concat_in += f'[a{i}]'
+    filters.append(f'{concat_in}concat=n={len(intervals)}:v=1:a={1 if has_audio else 0}[outv]' + ('[outa]' if has_audio else ''))
+    cmd += ['-filter_complex', ';'.join(filters), '-map', '[outv]']
+    if has_audio:
+        cmd += ['-map', '[outa]', '-c:a', 'aac']
+    cmd += ['-c:v', 'libx264', out]
+    with jobs.stage('cut', segments=len(intervals)):
+        result = runffmpeg(cmd, ctx=ctx)
+    logger.debug(f"Completed cutting and concatenating into {out}")
+    return result
+
+
+# 当前进程可用的 CPU 核数
+def get_cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# 并行执行多个 cut_from_video，cut_jobs 为 cut_from_video 参数字典列表
+# 同时运行的 ffmpeg 进程数按 CPU 核数 / 每进程线程数 计算，全部完成后若有失败则汇总报错
+def cut_segments(cut_jobs, *, workers=None, threads=None, ctx=None):
+    threads = threads or CUT_THREADS_PER_JOB
+    workers = workers or CUT_WORKERS or max(1, get_cpu_count() // threads)
+    workers = max(1, min(workers, len(cut_jobs)))
+    logger.debug(f"Cutting {len(cut_jobs)} segments with {workers} workers, {threads} threads each")
+    errors = {}
+
+    # 每个片段计为一个 cut 阶段，与 filter 方式相同，线程池中执行时仍记录到当前任务
+    @jobs.bind
+    def _cut(i, job):
+        with jobs.stage('cut', segment=i, ss=job['ss'], to=job['to']):
+            return cut_from_video(threads=threads, ctx=ctx, **job)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_cut, i, job): i for i, job in enumerate(cut_jobs)}
+        for done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Cutting segment {i} ({cut_jobs[i]['ss']}-{cut_jobs[i]['to']}) failed: {e}")
+                errors[i] = str(e)
+            jobs.report('cut', segment=i, ok=i not in errors, done=done, total=len(cut_jobs))
+    if errors:
+        msg = '; '.join(f"segment {i} ({cut_jobs[i]['ss']}-{cut_jobs[i]['to']}): {errors[i]}" for i in sorted(errors))
+        raise Exception(f'{len(errors)}/{len(cut_jobs)} 个片段裁剪失败: {msg}')
+    return True
+
+
 # 创建 多个连接文件
 def create_concat_txt(filelist, concat_txt=None):
     logger.debug(f"Creating concat text file from filelist: {filelist}, output: {concat_txt}")
@@ -701,14 +1042,12 @@ def create_concat_txt(filelist, concat_txt=None):
 
 
 # 多个视频片段连接 cuda + h264_cuvid
-def concat_multi_mp4(*, out=None, concat_txt=None):
+# concat 列表中的相对路径由 ffmpeg 按列表文件所在目录解析，无需切换当前目录
+def concat_multi_mp4(*, out=None, concat_txt=None, ctx=None):
     logger.debug(f"Concatenating multiple MP4 files into {out} using {concat_txt}")
-    os.chdir(os.path.dirname(concat_txt))
-    logger.debug(f"Changed working directory to {os.path.dirname(concat_txt)}")
-    runffmpeg(
-        ['-y', '-f', 'concat', '-i', concat_txt, '-c:v', f"libx264", out])
-    os.chdir(ROOT_DIR)
-    logger.debug(f"Changed working directory back to {ROOT_DIR}")
+    with jobs.stage('concat'):
+        runffmpeg(
+            ['-y', '-f', 'concat', '-i', concat_txt, '-c:v', f"libx264", out], ctx=ctx)
     return True
 
 
@@ -792,27 +1131,27 @@ def merge_intervals(intervals):
             merged.append(current)
     return merged
 
-def get_video_duration(video_path):
+def get_video_duration(video_path, *, ctx=None):
     # 使用已定义的get_video_ms函数获取毫秒，再转为秒
-    ms = get_video_ms(video_path)
+    ms = get_video_ms(video_path, ctx=ctx)
     return ms / 1000.0 if ms else 0.0
 
-def create_cut_video(video_path, time_list):
+def create_cut_video(video_path, time_list, ctx=None):
     """
-    根据需要删除的时间段列表从原视频中移除这些片段，保留其他片段，并输出到output目录下的final_cut.mp4
+    根据需要删除的时间段列表从原视频中移除这些片段，保留其他片段，并输出到工作目录下的final_cut.mp4
     time_list格式: "00:00:10-00:00:20,00:01:00-00:01:30"
     其中这些区间的片段将被删除，输出视频将不包含这些区间
+    ctx 未指定时工作目录为 output，临时文件放在 output/temp；并行处理多个视频时应为每个视频指定不同的 ctx
     """
-    logger.debug(f"Entering create_cut_video with video_path={video_path}, time_list={time_list}")
+    logger.debug("Entering create_cut_video with video_path=%s, time_list=%s, ctx=%s", video_path, brief(time_list), ctx)
 
-    output_dir = Path("output")
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    # 创建临时工作目录
-    working_dir = output_dir / "temp"
-    working_dir.mkdir(parents=True, exist_ok=True)
+    ctx = ctx or WorkContext(f'{ROOT_DIR}/output', tmp_dir=f'{ROOT_DIR}/output/temp')
+    output_dir = Path(ctx.work_dir)
+
+    # 临时工作目录
+    working_dir = Path(ctx.tmp_dir)
     
-    total_duration = get_video_duration(video_path)
+    total_duration = get_video_duration(video_path, ctx=ctx)
     logger.debug(f"Video total duration: {total_duration}s")
 
     # 解析要删除的片段时间区间并合并
@@ -830,7 +1169,7 @@ def create_cut_video(video_path, time_list):
                     remove_intervals.append((start_sec, end_sec))
 
     remove_intervals = merge_intervals(remove_intervals)
-    logger.debug(f"Final remove intervals: {remove_intervals}")
+    logger.debug("Final remove intervals: %s", brief(remove_intervals))
 
     # 计算保留片段
     keep_intervals = []
@@ -842,40 +1181,40 @@ def create_cut_video(video_path, time_list):
     if prev_end < total_duration:
         keep_intervals.append((prev_end, total_duration))
     
-    logger.debug(f"Keep intervals: {keep_intervals}")
+    logger.debug("Keep intervals: %s", brief(keep_intervals))
 
     if not keep_intervals:
         # 没有保留区间则输出一个空白视频
         logger.warning("No intervals to keep, creating an empty video.")
         final_output = output_dir / "final_cut.mp4"
-        subprocess.run([
-            "ffmpeg", "-y", 
-            "-f", "lavfi", 
-            "-i", "color=black:duration=1:size=320x240:rate=25", 
+        runffmpeg([
+            "-y",
+            "-f", "lavfi",
+            "-i", "color=black:duration=1:size=320x240:rate=25",
             "-c:v", "libx264",
             str(final_output)
-        ], check=True)
+        ], ctx=ctx)
         return str(final_output)
 
     file_list = []
+    cut_jobs = []
     for i, (start_sec, end_sec) in enumerate(keep_intervals):
         segment_file_name = f'segment-{i}.mp4'
         segment_file_path = working_dir / segment_file_name
         start_str = seconds_to_time_str(start_sec).replace(',', '.')
         end_str = seconds_to_time_str(end_sec).replace(',', '.')
-        logger.debug(f"Cutting segment {i}: start={start_str}, end={end_str}, output={segment_file_path}")
-        cut_from_video(source=video_path, ss=start_str, to=end_str, out=str(segment_file_path))
+        logger.debug("Cutting segment %s: start=%s, end=%s, output=%s", i, start_str, end_str, segment_file_path)
+        cut_jobs.append({"source": video_path, "ss": start_str, "to": end_str, "out": str(segment_file_path)})
         file_list.append(f"file '{segment_file_path.name}'")
+    cut_segments(cut_jobs, ctx=ctx)
 
     concat_txt_path = working_dir / 'file.txt'
     logger.debug(f"Writing concat list to file: {concat_txt_path}")
     concat_txt_path.write_text('\n'.join(file_list), encoding='utf-8')
     
-    # 使用绝对路径来传递给 concat_multi_mp4，以确保内部切换目录后仍能正确定位文件
-    concat_txt_abs = concat_txt_path.resolve()  # 获取绝对路径
     final_output = output_dir / "final_cut.mp4"
     logger.debug(f"Concatenating video segments into {final_output}")
-    concat_multi_mp4(out=str(final_output.resolve()), concat_txt=str(concat_txt_abs))
+    concat_multi_mp4(out=str(final_output), concat_txt=str(concat_txt_path), ctx=ctx)
     
     # 清理临时文件
     logger.debug("Cleaning up temporary files")
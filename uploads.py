@@ -0,0 +1,183 @@
+"""
+分片断点续传上传
+
+客户端先以 文件名、大小 初始化上传，得到随机生成的上传 id 和已接收的偏移量，然后按固定大小的分片依次上传，
+每个分片携带 sha256 校验值，直接写入磁盘上的临时文件；中断后客户端以保存的上传 id 再次初始化，从已接收的偏移量继续。
+全部接收后校验整个文件的 sha256，再由调用方移动到最终位置
+"""
+import hashlib
+import json
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from cfg import CACHE_DIR, UPLOAD_CHUNK_SIZE, UPLOAD_TTL, get_logger
+
+logger = get_logger('uploads')
+
+UPLOAD_DIR = f'{CACHE_DIR}/uploads'
+Path(UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
+
+# 每个上传的增量 sha256 计算状态 {upload_id: (已计算到的偏移量, hasher)}
+_hashers = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def _upload_lock(upload_id):
+    with _lock:
+        if upload_id not in _locks:
+            _locks[upload_id] = threading.Lock()
+        return _locks[upload_id]
+
+
+def _meta_file(upload_id):
+    return f'{UPLOAD_DIR}/{upload_id}.json'
+
+
+def _part_file(upload_id):
+    return f'{UPLOAD_DIR}/{upload_id}.part'
+
+
+def _load(upload_id):
+    # upload_id 来自客户端，只允许 32 位十六进制，防止路径穿越
+    if len(upload_id) != 32 or not all(c in '0123456789abcdef' for c in upload_id):
+        raise Exception('上传不存在')
+    try:
+        with open(_meta_file(upload_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise Exception('上传不存在')
+
+
+# 上传完成或过期后释放其锁和 sha256 计算状态
+def _forget(upload_id):
+    with _lock:
+        _locks.pop(upload_id, None)
+        _hashers.pop(upload_id, None)
+
+
+# 删除超过 UPLOAD_TTL 秒未完成的上传，以最后收到分片的时间计算
+def _prune():
+    now = time.time()
+    for it in Path(UPLOAD_DIR).glob('*.json'):
+        try:
+            part = Path(_part_file(it.stem))
+            mtime = max(it.stat().st_mtime, part.stat().st_mtime if part.is_file() else 0)
+            if now - mtime > UPLOAD_TTL:
+                Path(_part_file(it.stem)).unlink(missing_ok=True)
+                it.unlink(missing_ok=True)
+                _forget(it.stem)
+                logger.info(f"Removed stale upload {it.stem}")
+        except Exception as e:
+            logger.warning(f"Failed to remove stale upload {it.stem}: {e}")
+
+
+# 初始化上传并返回上传状态，每次初始化生成新的随机 id
+# upload_id 为客户端保存的未完成上传，其 kind、文件名、大小、sha256 均一致时从已接收的偏移量继续，否则重新开始
+# 上传 id 不由文件名和大小推算，同名同大小的另一个文件不会接在旧文件已上传的部分之后
+def init(*, filename, size, kind, sha256=None, upload_id=None):
+    size = int(size)
+    if size <= 0:
+        raise Exception('文件大小无效')
+    _prune()
+    if upload_id:
+        try:
+            meta = status(upload_id)
+        except Exception:
+            meta = None
+        if meta and (meta['kind'], meta['filename'], meta['size'], meta.get('sha256')) == (kind, filename, size, sha256):
+            logger.info(f"Resuming upload {upload_id} for {filename} at {meta['offset']}")
+            return meta
+        logger.info(f"Upload {upload_id} cannot be resumed for {filename}, starting a new upload")
+    upload_id = uuid.uuid4().hex
+    meta = {"id": upload_id, "filename": filename, "size": size, "kind": kind, "sha256": sha256,
+            "created": time.time()}
+    Path(_part_file(upload_id)).touch()
+    Path(_meta_file(upload_id)).write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+    logger.info(f"Initialized upload {upload_id} for {filename}, size={size}")
+    return status(upload_id)
+
+
+def status(upload_id):
+    meta = _load(upload_id)
+    part = Path(_part_file(upload_id))
+    meta['offset'] = part.stat().st_size if part.is_file() else 0
+    meta['chunk_size'] = UPLOAD_CHUNK_SIZE
+    return meta
+
+
+def _get_hasher(upload_id, offset):
+    with _lock:
+        state = _hashers.get(upload_id)
+    if state and state[0] == offset:
+        return state[1]
+    # 服务重启或分片重传后，根据磁盘上已接收的内容重新计算
+    hasher = hashlib.sha256()
+    with open(_part_file(upload_id), 'rb') as f:
+        remain = offset
+        while remain > 0:
+            data = f.read(min(remain, 1024 * 1024))
+            if not data:
+                break
+            hasher.update(data)
+            remain -= len(data)
+    return hasher
+
+
+# 将 stream 中 length 字节写入 offset 处，offset 必须等于已接收的字节数，校验失败时丢弃该分片
+def write_chunk(upload_id, *, offset, length, stream, chunk_sha256=None):
+    with _upload_lock(upload_id):
+        meta = status(upload_id)
+        if offset != meta['offset']:
+            raise Exception(f'分片偏移量不匹配，服务器已接收 {meta["offset"]} 字节')
+        if length <= 0 or length > UPLOAD_CHUNK_SIZE or offset + length > meta['size']:
+            raise Exception('分片大小无效')
+
+        file_hasher = _get_hasher(upload_id, offset).copy()
+        chunk_hasher = hashlib.sha256()
+        received = 0
+        ok = False
+        with open(_part_file(upload_id), 'r+b') as f:
+            f.seek(offset)
+            try:
+                while received < length:
+                    data = stream.read(min(1024 * 1024, length - received))
+                    if not data:
+                        break
+                    f.write(data)
+                    chunk_hasher.update(data)
+                    file_hasher.update(data)
+                    received += len(data)
+                if received != length:
+                    raise Exception(f'分片不完整，仅接收 {received}/{length} 字节')
+                if chunk_sha256 and chunk_hasher.hexdigest() != chunk_sha256.lower():
+                    raise Exception('分片校验失败')
+                ok = True
+            finally:
+                if not ok:
+                    f.truncate(offset)
+        with _lock:
+            _hashers[upload_id] = (offset + length, file_hasher)
+        logger.debug(f"Upload {upload_id} received chunk at {offset}, {length} bytes")
+        return offset + length
+
+
+# 校验整个文件并移动到 target，sha256 为客户端提供的整文件校验值(可选)，返回 target
+def complete(upload_id, *, target, sha256=None):
+    with _upload_lock(upload_id):
+        meta = status(upload_id)
+        if meta['offset'] != meta['size']:
+            raise Exception(f'文件未上传完整，已接收 {meta["offset"]}/{meta["size"]} 字节')
+        digest = _get_hasher(upload_id, meta['offset']).hexdigest()
+        expected = sha256 or meta.get('sha256')
+        if expected and expected.lower() != digest:
+            raise Exception('文件校验失败')
+        # 上传目录和 target 可能不在同一文件系统，shutil.move 在跨文件系统时改为复制后删除
+        shutil.move(_part_file(upload_id), target)
+        Path(_meta_file(upload_id)).unlink(missing_ok=True)
+        _forget(upload_id)
+        logger.info(f"Upload {upload_id} completed, sha256={digest}, saved as {target}")
+    return target